@@ -0,0 +1,365 @@
+"""Offline load test for bot.py's command handlers.
+
+Drives /done -> the OKAY button, AddSlotModal.on_submit, /manage-slot,
+/profile and /receivingmethod against fake interactions, with a local stand-in
+for Discord's REST API that just sleeps for --api-latency. No token or network
+is needed; all data files go to a temporary directory.
+
+    python bench.py --users 20000 --ops 2000 --concurrency 50
+    python bench.py --backend sqlite --api-latency 0
+    python bench.py --memory --users 200000
+    python bench.py --memory --members 100000
+"""
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import discord
+from discord import app_commands
+
+# ---------- Fake Discord ----------
+class FakeAPI:
+    # stands in for Discord's HTTP API: every call costs `latency` seconds and is counted
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self, result=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return result
+
+
+class FakeAsset:
+    def __init__(self, user_id):
+        self.url = f"https://cdn.discordapp.com/avatars/{user_id}/avatar.png"
+
+
+class FakePermissions:
+    administrator = True
+
+
+class FakeMember:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+        self.display_name = f"user{user_id}"
+        self.avatar = FakeAsset(user_id)
+        self.guild_permissions = FakePermissions()
+
+
+class FakeMessage:
+    def __init__(self, api):
+        self.api = api
+
+    async def edit(self, **kwargs):
+        return await self.api.call(self)
+
+
+class FakeChannel:
+    def __init__(self, api, channel_id):
+        self.api = api
+        self.id = channel_id
+
+    async def send(self, content=None, **kwargs):
+        return await self.api.call(FakeMessage(self.api))
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def _respond(self, **kwargs):
+        if self.done:
+            raise RuntimeError("interaction already responded to")
+        self.done = True
+        self.interaction.sent.append(kwargs)
+        await self.interaction.api.call()
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond(content=content, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        await self._respond(**kwargs)
+
+    async def defer(self, **kwargs):
+        await self._respond(**kwargs)
+
+    async def send_modal(self, modal):
+        await self._respond(modal=modal)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self.interaction.sent.append(dict(content=content, **kwargs))
+        return await self.interaction.api.call(FakeMessage(self.interaction.api))
+
+
+class FakeInteraction:
+    def __init__(self, api, user, channel):
+        self.api = api
+        self.user = user
+        self.channel = channel
+        self.guild_id = 1
+        self.guild = None
+        self.type = None
+        self.data = {}
+        self.message = FakeMessage(api)
+        self.extras = {}
+        self.command = None
+        self.sent = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def edit_original_response(self, **kwargs):
+        return await self.api.call(self.message)
+
+
+# ---------- Scenarios ----------
+SLOT_TYPES = [app_commands.Choice(name="Crypto", value="crypto"), app_commands.Choice(name="UPI", value="upi")]
+DELETE = app_commands.Choice(name="Delete", value="delete")
+
+
+class Bench:
+    def __init__(self, bot, api, users, channels):
+        self.bot = bot
+        self.api = api
+        self.users = users
+        self.channels = [FakeChannel(api, 1000 + i) for i in range(channels)]
+
+    def interaction(self, user_id):
+        return FakeInteraction(self.api, FakeMember(user_id), random.choice(self.channels))
+
+    def random_user(self):
+        return random.randrange(1, self.users + 1)
+
+    async def submit_slot(self, user_id, slot_type, slot_num):
+        modal = self.bot.AddSlotModal(slot_type, slot_num)
+        values = ["0xabc" + str(user_id), "USDT POLY"] if slot_type == "crypto" else [f"user{user_id}@upi"]
+        for item, value in zip(modal.children, values):
+            item._refresh_state(None, {"value": value})
+        await modal.on_submit(self.interaction(user_id))
+
+    async def done(self):
+        exchanger = self.interaction(self.random_user())
+        client = FakeMember(self.random_user())
+        await self.bot.done.callback(exchanger, client, round(random.uniform(5, 2000), 2), "USDT → UPI")
+        view = exchanger.sent[0]["view"]
+        click = FakeInteraction(self.api, exchanger.user, exchanger.channel)
+        click.type = discord.InteractionType.component
+        click.data = {"custom_id": view.children[0].custom_id}
+        await self.bot.on_interaction(click)
+
+    async def add_slot(self):
+        await self.submit_slot(self.random_user(), random.choice(["crypto", "upi"]), random.randint(1, 5))
+
+    async def manage_slot(self):
+        await self.bot.manage_slot.callback(
+            self.interaction(self.random_user()), DELETE, random.choice(SLOT_TYPES), random.randint(1, 5)
+        )
+
+    async def profile(self):
+        await self.bot.profile.callback(self.interaction(self.random_user()), FakeMember(self.random_user()))
+
+    async def receivingmethod(self):
+        await self.bot.receivingmethod.callback(self.interaction(self.random_user()), "upi", 1)
+
+    async def seed(self):
+        # every user gets a UPI slot and an exchange total, so the stores are realistically large
+        storage = self.bot.storage
+        for uid in range(1, self.users + 1):
+            storage.set_slot(uid, "upi", 1, {"upi": f"user{uid}@upi"})
+            storage.adjust_total(uid, random.uniform(0, 5000))
+        await storage.flush()
+
+
+def io_bytes_written():
+    # bytes handed to write(2) by this process; Linux only
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(pct / 100 * len(sorted_values)))]
+
+
+async def run_scenario(bench, name, ops, concurrency):
+    handler = getattr(bench, name)
+    latencies = []
+    queue = iter(range(ops))
+    calls_before = bench.api.calls
+    written_before = io_bytes_written()
+
+    async def worker():
+        for _ in queue:
+            started = time.perf_counter()
+            await handler()
+            latencies.append(time.perf_counter() - started)
+
+    # the writer runs alongside the handlers as it does in the bot, then is stopped before the final
+    # drain so two flushes never overlap
+    bot = bench.bot
+    started = time.perf_counter()
+    writer = asyncio.create_task(bot.persistence_writer())
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    bot.flush_stop.set()
+    bot.flush_wakeup.set()
+    await writer
+    bot.flush_stop.clear()
+    await bot.storage.flush()
+    elapsed = time.perf_counter() - started
+    written_after = io_bytes_written()
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "ops": ops,
+        "ops_per_s": ops / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "api_calls_per_op": (bench.api.calls - calls_before) / ops,
+        "bytes_per_op": None if written_before is None else (written_after - written_before) / ops,
+    }
+
+
+# ---------- Memory ----------
+def synthetic_data(users):
+    # the on-disk layout: nested dicts keyed by stringified ids and slot numbers
+    slots, totals = {}, {}
+    for uid in range(10**17, 10**17 + users):
+        slots[str(uid)] = {
+            "crypto": {"1": {"address": f"0x{uid:040x}", "type": "USDT POLY"}},
+            "upi": {"1": {"upi": f"user{uid}@upi"}, "2": {"upi": f"alt{uid}@upi"}},
+        }
+        totals[str(uid)] = {"total_amount": random.uniform(0, 5000), "deals": random.randint(1, 50)}
+    return slots, totals
+
+
+def measure(build):
+    tracemalloc.start()
+    kept = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return kept, current
+
+
+def memory_report(users):
+    import json
+    bot = importlib.import_module("bot")
+    slots, totals = synthetic_data(users)
+    slots_text, totals_text = json.dumps(slots), json.dumps(totals)
+    del slots, totals
+
+    _, dict_slots = measure(lambda: json.loads(slots_text))
+    _, dict_totals = measure(lambda: json.loads(totals_text))
+    raw_slots, raw_totals = json.loads(slots_text), json.loads(totals_text)
+    _, compact_slots = measure(lambda: bot.SlotTable(raw_slots))
+    _, compact_totals = measure(lambda: bot.TotalsTable(raw_totals))
+
+    print(f"Memory for {users} users (tracemalloc, steady state after load)")
+    print(f"{'store':<12}{'dict layout':>14}{'compact':>14}{'saved':>8}")
+    for name, before, after in (("slots", dict_slots, compact_slots), ("totals", dict_totals, compact_totals),
+                                ("total", dict_slots + dict_totals, compact_slots + compact_totals)):
+        print(f"{name:<12}{before / 2**20:>11.1f} MB{after / 2**20:>11.1f} MB{1 - after / before:>8.0%}")
+
+
+def member_payload(uid):
+    # what a guild member chunk carries for one member
+    return {
+        "user": {"id": str(uid), "username": f"user{uid}", "global_name": f"User {uid}", "discriminator": "0",
+                 "avatar": f"{uid:032x}"},
+        "nick": None, "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0,
+    }
+
+
+def member_report(members):
+    # full chunking keeps a Member (and its User) for everyone; LOW_MEMORY keeps at most
+    # MEMBER_CACHE_SIZE small entries, whatever the guild size
+    bot = importlib.import_module("bot")
+    state = bot.bot._connection
+    payloads = [member_payload(uid) for uid in range(10**17, 10**17 + members)]
+
+    def chunked():
+        guild = discord.Guild(data={"id": "1", "name": "synthetic", "member_count": members}, state=state)
+        for payload in payloads:
+            guild._add_member(discord.Member(data=payload, guild=guild, state=state))
+        return guild
+
+    def lazy():
+        guild = discord.Guild(data={"id": "1", "name": "synthetic", "member_count": members}, state=state)
+        cache = bot.MemberCache()
+        for payload in payloads:
+            cache.remember(discord.Member(data=payload, guild=guild, state=state))
+        return guild, cache
+
+    _, full = measure(chunked)
+    (_, cache), lean = measure(lazy)
+    print(f"Members for a {members}-member guild (tracemalloc)")
+    print(f"{'mode':<28}{'held':>10}{'memory':>12}")
+    print(f"{'chunked, default cache':<28}{members:>10}{full / 2**20:>9.1f} MB")
+    print(f"{'LOW_MEMORY + member LRU':<28}{len(cache):>10}{lean / 2**20:>9.1f} MB")
+
+
+async def main(args):
+    bot = importlib.import_module("bot")
+    bench = Bench(bot, FakeAPI(args.api_latency), args.users, args.channels)
+    seeded = time.perf_counter()
+    await bench.seed()
+    print(f"Seeded {args.users} users in {time.perf_counter() - seeded:.2f}s "
+          f"(backend={args.backend}, concurrency={args.concurrency}, api latency={args.api_latency * 1000:.0f}ms)")
+
+    print(f"{'scenario':<16}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'api/op':>8}{'bytes/op':>10}")
+    for name in args.scenarios:
+        result = await run_scenario(bench, name, args.ops, args.concurrency)
+        written = "n/a" if result["bytes_per_op"] is None else f"{result['bytes_per_op']:.0f}"
+        print(f"{name:<16}{result['ops_per_s']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+              f"{result['p99_ms']:>10.1f}{result['api_calls_per_op']:>8.1f}{written:>10}")
+    bot.close_storage()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000, help="simulated users seeded into the store")
+    parser.add_argument("--ops", type=int, default=1000, help="operations per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="interactions in flight at once")
+    parser.add_argument("--channels", type=int, default=20, help="channels the interactions are spread over")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="simulated Discord round trip, seconds")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--data-dir", help="where to keep the data files (default: a fresh temp dir)")
+    parser.add_argument("--memory", action="store_true", help="compare in-memory layouts instead of running the load test")
+    parser.add_argument("--members", type=int, help="with --memory: compare member caching for a guild this large")
+    parser.add_argument("--scenarios", nargs="+",
+                        default=["done", "add_slot", "manage_slot", "profile", "receivingmethod"])
+    args = parser.parse_args()
+
+    os.environ["STORAGE_BACKEND"] = args.backend
+    os.environ.pop("TOKEN", None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(args.data_dir or tempfile.mkdtemp(prefix="gameclub-bench-"))
+    if args.memory and args.members:
+        member_report(args.members)
+    elif args.memory:
+        memory_report(args.users)
+    else:
+        asyncio.run(main(args))
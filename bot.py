@@ -1,24 +1,68 @@
 import os
 import discord
+import segno
 from discord import app_commands
 from discord.ext import commands
 from discord.ui import Modal, TextInput
-from datetime import datetime, timedelta, timezone
-from flask import Flask
-from threading import Thread
+from datetime import date, datetime, timedelta, timezone
+from aiohttp import web
+from threading import Thread, Lock
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import asyncio
+import bisect
+import contextvars
+import csv
+import functools
+import gzip
+import hashlib
+import inspect
+import io
+import itertools
 import json
+import re
+import time
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import uuid
+import zlib
+from urllib.parse import quote
 
 # ---------- CONFIG ----------
 IST = timezone(timedelta(hours=5, minutes=30))
 DATA_FILE = "user_slots.json"
 EXCHANGE_FILE = "exchanges.json"
+EXCHANGER_FILE = "exchangers.json"
+STATS_FILE = "deal_stats.json"   # per-client / per-exchanger time buckets
+LEDGER_FILE = "deals.log"        # one JSON line per confirmed deal
+RATES_FILE = "rates.json"        # version history of /setrate changes
+PENDING_FILE = "pending_deals.json"  # /done confirmations still waiting for a click
+BUCKET_KEEP_DAYS = 35
+BUCKET_KEEP_WEEKS = 26
+PROFILE_WINDOWS = (7, 30)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")  # "json" or "sqlite"
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "gameclub.db")
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", 1.0))  # seconds a write waits on another worker's lock
+SLOT_CACHE_SIZE = int(os.environ.get("SLOT_CACHE_SIZE", 10000))  # users whose slots the SQLite backend keeps in memory
+RANK_CACHE_SIZE = 10000  # leaderboard ranks the SQLite backend remembers between changes
 
-I2C_RATE = 95.0
-C2I_RATE_LOW = 91.0
-C2I_RATE_HIGH = 91.5
-C2I_THRESHOLD = 100.0
+# starting tiers as [min_amount, rate]; /setrate changes are versioned in storage
+DEFAULT_RATES = {
+    "i2c": [[0.0, 95.0]],
+    "c2i": [[0.0, 91.0], [100.0, 91.5]],
+}
 
 # ---------- Persistent Storage ----------
+JOURNAL_COMPACT_EVERY = int(os.environ.get("JOURNAL_COMPACT_EVERY", 5000))
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", 1.0))        # seconds between background flushes
+FLUSH_MAX_PENDING = int(os.environ.get("FLUSH_MAX_PENDING", 500))    # flush early once this many mutations queue up
+FLUSH_REPORT_EVERY = float(os.environ.get("FLUSH_REPORT_EVERY", 300))  # seconds between flush summaries in the log
+
 def load_json(file_path, default):
     if not os.path.exists(file_path):
         return default
@@ -26,32 +70,1833 @@ def load_json(file_path, default):
         return json.load(f)
 
 def save_json(file_path, data):
-    with open(file_path, "w") as f:
-        json.dump(data, f, indent=4)
+    # write next to the target and swap it in, so a crash never leaves a truncated file
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(data if isinstance(data, str) else json.dumps(data, indent=4))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+class Journal:
+    # Snapshot file (same layout as before) plus an append-only log of
+    # {"k": key, "v": value} records. A null value means the key was removed.
+    # Records carry the full value for the key, so replaying one twice is harmless.
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.old_log_path = f"{path}.log.old"
+        self.data = load_json(path, {})
+        self.records = 0
+        self.compactor = None
+        self.dirty = set()
+        self.pending = 0  # mutations since the last flush, including repeats of the same key
+        self.write_lock = Lock()
+        # an old log only survives if we died mid-compaction; it is older than the live log
+        for log_path in (self.old_log_path, self.log_path):
+            self.records += self._replay(log_path, readonly)
+        self.log = None if readonly else open(self.log_path, "a")
+
+    def _replay(self, log_path, readonly=False):
+        if not os.path.exists(log_path):
+            return 0
+        count = 0
+        good_end = 0
+        with open(log_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn tail from a crash mid-append
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    break
+                if rec["v"] is None:
+                    self.data.pop(rec["k"], None)
+                else:
+                    self.data[rec["k"]] = rec["v"]
+                good_end += len(line)
+                count += 1
+        if not readonly and good_end != os.path.getsize(log_path):
+            with open(log_path, "r+b") as f:
+                f.truncate(good_end)
+        return count
+
+    def record(self, key):
+        # only marks the key; the persistence writer turns it into a log record later
+        self.dirty.add(key)
+        self.pending += 1
+        if self.pending >= FLUSH_MAX_PENDING:
+            flush_wakeup.set()
+
+    def attach(self, table):
+        # hand the replayed data over to a table that keeps it in its own layout;
+        # records and snapshots are then rebuilt from the table
+        self.encode = table.encode
+        self.snapshot = table.snapshot
+        self.dump = table.dump
+        self.data = None
+
+    def encode(self, key):
+        return self.data.get(key)
+
+    def snapshot(self):
+        # values are replaced on update, never edited in place, so a shallow copy is enough
+        return dict(self.data)
+
+    def dump(self, snapshot):
+        return snapshot
+
+    def drain(self):
+        # called on the event loop, so values can't change while being serialized
+        lines = "".join(
+            json.dumps({"k": key, "v": self.encode(key)}, separators=(",", ":")) + "\n"
+            for key in self.dirty
+        )
+        mutations = self.pending
+        self.dirty = set()
+        self.pending = 0
+        return lines, mutations
+
+    def write(self, lines):
+        # safe to run in a worker thread
+        with self.write_lock:
+            self.log.write(lines)
+            self.log.flush()
+            self.records += lines.count("\n")
+
+    def flush(self):
+        lines, mutations = self.drain()
+        if lines:
+            self.write(lines)
+        return mutations
+
+    def compact(self, wait=False):
+        if self.compactor and self.compactor.is_alive():
+            return
+        # only the copy happens on the loop; building and serializing the snapshot runs in the background
+        snapshot = self.snapshot()
+        with self.write_lock:
+            self._rotate_log()
+        self.compactor = Thread(target=self._write_snapshot, args=(snapshot,), daemon=True)
+        self.compactor.start()
+        if wait:
+            self.compactor.join()
+
+    def _rotate_log(self):
+        self.log.close()
+        if os.path.exists(self.old_log_path):
+            # a previous compaction never finished: keep its records until this snapshot lands
+            with open(self.log_path, "rb") as src, open(self.old_log_path, "ab") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.log_path)
+        else:
+            os.replace(self.log_path, self.old_log_path)
+        self.log = open(self.log_path, "a")
+        self.records = 0
+
+    def _write_snapshot(self, snapshot):
+        try:
+            save_json(self.path, json.dumps(self.dump(snapshot)))
+            os.remove(self.old_log_path)
+        except Exception as e:
+            print(f"⚠️ Failed to compact {self.path}: {e}")
+
+# ---------- Leaderboard Index ----------
+class RankIndex:
+    # Totals kept sorted as (-amount, user_id) in short sorted runs, so an
+    # update is a bisect into one run of at most 2 * LOAD entries instead of
+    # a re-sort of everyone.
+    LOAD = 256
+
+    def __init__(self, totals=()):
+        entries = sorted((-float(amount), int(uid)) for uid, amount in totals)
+        self.keys = {entry[1]: entry for entry in entries}
+        self.runs = [entries[i:i + self.LOAD] for i in range(0, len(entries), self.LOAD)]
+        self.maxes = [run[-1] for run in self.runs]
+        self.version = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, user_id, amount):
+        uid = int(user_id)
+        old = self.keys.get(uid)
+        if old is not None:
+            self._remove(old)
+        self._insert((-float(amount), uid))
+        self.keys[uid] = (-float(amount), uid)
+        self.version += 1
+
+    def _insert(self, entry):
+        if not self.runs:
+            self.runs.append([entry])
+            self.maxes.append(entry)
+            return
+        i = min(bisect.bisect_left(self.maxes, entry), len(self.runs) - 1)
+        run = self.runs[i]
+        bisect.insort(run, entry)
+        self.maxes[i] = run[-1]
+        if len(run) > 2 * self.LOAD:
+            self.runs[i:i + 1] = [run[:self.LOAD], run[self.LOAD:]]
+            self.maxes[i:i + 1] = [self.runs[i][-1], self.runs[i + 1][-1]]
+
+    def _remove(self, entry):
+        i = bisect.bisect_left(self.maxes, entry)
+        run = self.runs[i]
+        del run[bisect.bisect_left(run, entry)]
+        if run:
+            self.maxes[i] = run[-1]
+        else:
+            del self.runs[i]
+            del self.maxes[i]
+
+    def top(self, k):
+        result = []
+        for run in self.runs:
+            for neg_amount, uid in run:
+                if len(result) == k:
+                    return result
+                result.append((uid, -neg_amount))
+        return result
+
+    def rank(self, user_id):
+        key = self.keys.get(int(user_id))
+        if key is None:
+            return None
+        i = bisect.bisect_left(self.maxes, key)
+        return sum(len(run) for run in self.runs[:i]) + bisect.bisect_left(self.runs[i], key) + 1
+
+# ---------- Tracing ----------
+# Each slash command / component handler runs under a Trace. Time spent awaiting
+# Discord's REST API and time spent inside the storage backend are added to it,
+# so what's left of the total is our own code.
+TRACE_SAMPLES = int(os.environ.get("TRACE_SAMPLES", 1000))  # recent samples kept per command for percentiles
+
+class Trace:
+    __slots__ = ("name", "started", "discord", "storage")
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.discord = 0.0
+        self.storage = 0.0
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+trace_samples = {}  # name -> deque of (total, discord, storage)
+
+def start_trace(name):
+    trace = Trace(name)
+    current_trace.set(trace)
+    return trace
+
+def finish_trace(trace, status):
+    total = time.perf_counter() - trace.started
+    command_count.inc(trace.name, status)
+    command_latency.observe(total, trace.name)
+    samples = trace_samples.get(trace.name)
+    if samples is None:
+        samples = trace_samples[trace.name] = deque(maxlen=TRACE_SAMPLES)
+    samples.append((total, trace.discord, trace.storage))
+
+def traced(name):
+    # for component/modal callbacks, which don't pass through the command tree
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            trace = start_trace(name)
+            status = "error"
+            try:
+                result = await func(*args, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                finish_trace(trace, status)
+        return wrapper
+    return decorator
+
+def timed_discord_request(request):
+    @functools.wraps(request)
+    async def wrapper(*args, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return await request(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await request(*args, **kwargs)
+        finally:
+            trace.discord += time.perf_counter() - started
+    return wrapper
+
+# every REST call goes through one of these two: bot HTTP (channel sends, edits) and
+# the webhook adapter (interaction responses and followups)
+discord.http.HTTPClient.request = timed_discord_request(discord.http.HTTPClient.request)
+discord.webhook.async_.AsyncWebhookAdapter.request = timed_discord_request(discord.webhook.async_.AsyncWebhookAdapter.request)
+
+class TracedStorage:
+    # transparent wrapper that charges synchronous storage calls to the current trace
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if not callable(attr) or name.startswith("_") or inspect.iscoroutinefunction(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            trace = current_trace.get()
+            if trace is None:
+                return attr(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                trace.storage += time.perf_counter() - started
+        return call
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(pct / 100 * len(sorted_values)))]
+
+def trace_summary():
+    summary = {}
+    for name, samples in trace_samples.items():
+        totals = sorted(s[0] for s in samples)
+        count = len(samples)
+        discord_time = sum(s[1] for s in samples)
+        storage_time = sum(s[2] for s in samples)
+        own_time = max(0.0, sum(totals) - discord_time - storage_time)
+        summary[name] = {
+            "count": count,
+            "p50_ms": percentile(totals, 50) * 1000,
+            "p95_ms": percentile(totals, 95) * 1000,
+            "p99_ms": percentile(totals, 99) * 1000,
+            "discord_ms": discord_time / count * 1000,
+            "storage_ms": storage_time / count * 1000,
+            "own_ms": own_time / count * 1000,
+        }
+    return summary
+
+# ---------- Compact Records ----------
+# The JSON backend keeps every user in memory, so per-object overhead matters.
+# Slots are __slots__ records in fixed 5-entry lists and totals live in parallel
+# arrays; both convert back to the original dict layout for the journals.
+SLOT_COUNT = 5
+
+class CryptoSlot:
+    __slots__ = ("address", "type")
+
+    def __init__(self, address, type):
+        self.address = address
+        self.type = type
+
+    def to_dict(self):
+        return {"address": self.address, "type": self.type}
+
+class UpiSlot:
+    __slots__ = ("upi",)
+
+    def __init__(self, upi):
+        self.upi = upi
+
+    def to_dict(self):
+        return {"upi": self.upi}
+
+def make_slot(slot_type, record):
+    if slot_type == "crypto":
+        return CryptoSlot(record.get("address"), record.get("type"))
+    return UpiSlot(record.get("upi"))
+
+class UserSlots:
+    __slots__ = ("crypto", "upi")
+
+    def __init__(self):
+        self.crypto = [None] * SLOT_COUNT
+        self.upi = [None] * SLOT_COUNT
+
+    def to_dict(self):
+        return {
+            slot_type: {str(i + 1): slot.to_dict() for i, slot in enumerate(getattr(self, slot_type)) if slot is not None}
+            for slot_type in ("crypto", "upi")
+        }
+
+class SlotTable:
+    def __init__(self, raw=None):
+        self.users = {}  # int user id -> UserSlots
+        for uid, user in (raw or {}).items():
+            entry = self.users[int(uid)] = UserSlots()
+            for slot_type, slots in user.items():
+                for num, record in slots.items():
+                    if 1 <= int(num) <= SLOT_COUNT:
+                        getattr(entry, slot_type)[int(num) - 1] = make_slot(slot_type, record)
+                    else:
+                        print(f"⚠️ Ignoring {slot_type} slot {num} of user {uid}: outside 1-{SLOT_COUNT}")
+
+    def __len__(self):
+        return len(self.users)
+
+    def get(self, user_id):
+        user = self.users.get(int(user_id))
+        return user.to_dict() if user else None
+
+    def _edit(self, uid):
+        # writes go to a fresh copy of the user's slots, so a compaction snapshot can keep sharing the old one
+        old = self.users.get(uid)
+        user = self.users[uid] = UserSlots()
+        if old is not None:
+            user.crypto[:] = old.crypto
+            user.upi[:] = old.upi
+        return user
+
+    def set(self, user_id, slot_type, slot_num, record):
+        user = self._edit(int(user_id))
+        getattr(user, slot_type)[int(slot_num) - 1] = make_slot(slot_type, record)
+
+    def delete(self, user_id, slot_type, slot_num):
+        user = self.users.get(int(user_id))
+        if user is None or getattr(user, slot_type)[int(slot_num) - 1] is None:
+            return False
+        getattr(self._edit(int(user_id)), slot_type)[int(slot_num) - 1] = None
+        return True
+
+    def encode(self, key):
+        return self.get(key)
+
+    def snapshot(self):
+        return dict(self.users)
+
+    def dump(self, snapshot):
+        return {str(uid): user.to_dict() for uid, user in snapshot.items()}
+
+class TotalsTable:
+    def __init__(self, raw=None):
+        self.rows = {}  # int user id -> row in the arrays below
+        self.ids = array("q")
+        self.amounts = array("d")
+        self.deals = array("q")
+        for uid, totals in (raw or {}).items():
+            self.add(uid, totals["total_amount"], int(totals["deals"]))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def get(self, user_id):
+        row = self.rows.get(int(user_id))
+        if row is None:
+            return None
+        return {"total_amount": self.amounts[row], "deals": self.deals[row]}
+
+    def add(self, user_id, amount, deals):
+        uid = int(user_id)
+        row = self.rows.get(uid)
+        if row is None:
+            row = self.rows[uid] = len(self.ids)
+            self.ids.append(uid)
+            self.amounts.append(0.0)
+            self.deals.append(0)
+        self.amounts[row] += float(amount)
+        self.deals[row] += deals
+        return {"total_amount": self.amounts[row], "deals": self.deals[row]}
+
+    def amount_items(self):
+        return zip(self.ids, self.amounts)
+
+    def encode(self, key):
+        return self.get(key)
+
+    def snapshot(self):
+        return self.ids[:], self.amounts[:], self.deals[:]
+
+    def dump(self, snapshot):
+        return {str(uid): {"total_amount": amount, "deals": deals} for uid, amount, deals in zip(*snapshot)}
+
+# ---------- Storage Backends ----------
+def empty_slots():
+    return {"crypto": {}, "upi": {}}
+
+def empty_totals():
+    return {"total_amount": 0.0, "deals": 0}
+
+def bucket_keys(when):
+    day = when.astimezone(IST).date()
+    year, week, _ = day.isocalendar()
+    return {"day": day.isoformat(), "week": f"{year}-W{week:02d}", "month": day.strftime("%Y-%m")}
+
+def window_days(days, now=None):
+    # the day buckets covering the last `days` days, today included
+    today = (now or datetime.now(tz=IST)).astimezone(IST).date()
+    return [(today - timedelta(days=i)).isoformat() for i in range(days)]
+
+def deal_entry(deal_id, client_id, exchanger_id, amount, ex_type, when):
+    return {
+        "id": deal_id,
+        "client": int(client_id),
+        "exchanger": int(exchanger_id),
+        "amount": float(amount),
+        "type": ex_type,
+        "at": when.isoformat(),
+    }
+
+def ledger_entries(lines):
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue  # torn tail of a crashed append
+
+EXPORT_CHUNK = 1000  # rows fetched per round trip while exporting
+EXPORT_COLUMNS = {
+    "clients": ("user_id", "total_amount", "deals"),
+    "exchangers": ("user_id", "total_amount", "deals"),
+    "deals": ("id", "client", "exchanger", "amount", "type", "at"),
+}
+
+class Storage:
+    # Everything the commands read or write goes through one of these.
+    # User ids may be passed as int or str.
+    async def flush(self):
+        return 0
+
+    def generation(self):
+        # bumps when another process changed the shared store; process-local caches compare against it
+        return 0
+
+    async def find_rank(self, kind, user_id):
+        # rank() for use on the event loop; backends where counting is slow do it in a thread
+        return self.rank(kind, user_id)
+
+    async def import_batch(self, dataset, rows):
+        # import_rows() for use on the event loop; backends that can write off the loop do it in a thread
+        return self.import_rows(dataset, rows)
+
+    def deal_ids(self, candidates):
+        # which of these ids are already in the deal history, for /import to skip; None when the backend dedupes itself
+        return None
+
+    def close(self):
+        pass
+
+class JsonStorage(Storage):
+    # Whole data set in memory, persisted through the journals above.
+    def __init__(self, slots_path=DATA_FILE, exchanges_path=EXCHANGE_FILE, exchangers_path=EXCHANGER_FILE,
+                 stats_path=STATS_FILE, ledger_path=LEDGER_FILE, rates_path=RATES_FILE, pending_path=PENDING_FILE):
+        self.slots_journal = Journal(slots_path)
+        self.exchanges_journal = Journal(exchanges_path)
+        self.exchangers_journal = Journal(exchangers_path)
+        self.stats_journal = Journal(stats_path)
+        self.rates_journal = Journal(rates_path)  # rate versions keyed by version number
+        self.pending_journal = Journal(pending_path)  # unconfirmed /done deals keyed by deal id
+        self.journals = (self.slots_journal, self.exchanges_journal, self.exchangers_journal, self.stats_journal,
+                         self.rates_journal, self.pending_journal)
+        self.slots = SlotTable(self.slots_journal.data)
+        self.exchanges = TotalsTable(self.exchanges_journal.data)
+        self.exchangers = TotalsTable(self.exchangers_journal.data)
+        self.slots_journal.attach(self.slots)
+        self.exchanges_journal.attach(self.exchanges)
+        self.exchangers_journal.attach(self.exchangers)
+        self.stats = self.stats_journal.data
+        self.ranks = {
+            "client": RankIndex(self.exchanges.amount_items()),
+            "exchanger": RankIndex(self.exchangers.amount_items()),
+        }
+        # the ledger is write-only here: deals are appended, never loaded back into memory
+        self.ledger_path = ledger_path
+        self.ledger_lines = []
+        # bytes of the ledger known to be on disk, and lines handed to the writer but not yet there
+        self.ledger_size = os.path.getsize(ledger_path) if os.path.exists(ledger_path) else 0
+        self.ledger_writing = []
+
+    def get_slots(self, user_id):
+        return self.slots.get(user_id) or empty_slots()
+
+    def set_slot(self, user_id, slot_type, slot_num, record):
+        self.slots.set(user_id, slot_type, slot_num, record)
+        self.slots_journal.record(str(user_id))
+
+    def delete_slot(self, user_id, slot_type, slot_num):
+        if self.slots.delete(user_id, slot_type, slot_num):
+            self.slots_journal.record(str(user_id))
+
+    def get_client(self, user_id):
+        return self.exchanges.get(user_id) or empty_totals()
+
+    def get_exchanger(self, user_id):
+        return self.exchangers.get(user_id) or empty_totals()
+
+    def record_deal(self, client_id, exchanger_id, amount, ex_type="", deal_id=None, when=None):
+        when = when or datetime.now(tz=IST)
+        entry = deal_entry(deal_id or uuid.uuid4().hex, client_id, exchanger_id, amount, ex_type, when)
+        self.ledger_lines.append(json.dumps(entry, separators=(",", ":")) + "\n")
+        keys = bucket_keys(when)
+        self._add_buckets("client", client_id, keys, amount)
+        self._add_buckets("exchanger", exchanger_id, keys, amount)
+        client = self._add("client", client_id, amount, 1)
+        self._add("exchanger", exchanger_id, amount, 1)
+        return client
+
+    def add_pending(self, deal_id, entry):
+        self.pending_journal.data[deal_id] = entry
+        self.pending_journal.record(deal_id)
+
+    def pending_deals(self):
+        return list(self.pending_journal.data.items())
+
+    def claim_pending(self, deal_id):
+        # the first caller gets the entry, everyone after gets None
+        entry = self.pending_journal.data.pop(deal_id, None)
+        if entry is not None:
+            self.pending_journal.record(deal_id)
+        return entry
+
+    def confirm_pending(self, deal_id):
+        entry = self.claim_pending(deal_id)
+        if entry is None:
+            return None
+        return entry, self.record_deal(entry["client"], entry["exchanger"], entry["amount"], entry["type"], deal_id)
+
+    def _add_buckets(self, kind, user_id, keys, amount):
+        key = f"{kind}:{user_id}"
+        # a fresh entry rather than an in-place edit, so a compaction snapshot taken earlier stays intact
+        old = self.stats.get(key) or {"day": {}, "week": {}, "month": {}}
+        buckets = self.stats[key] = {period: dict(old[period]) for period in ("day", "week", "month")}
+        for period, bucket in keys.items():
+            totals = buckets[period].get(bucket, (0.0, 0))
+            buckets[period][bucket] = [totals[0] + float(amount), totals[1] + 1]
+        # keep only what the profile windows can reach, so each entry stays small
+        oldest_day = (date.fromisoformat(keys["day"]) - timedelta(days=BUCKET_KEEP_DAYS)).isoformat()
+        for bucket in [b for b in buckets["day"] if b < oldest_day]:
+            del buckets["day"][bucket]
+        if len(buckets["week"]) > BUCKET_KEEP_WEEKS:
+            for bucket in sorted(buckets["week"])[:-BUCKET_KEEP_WEEKS]:
+                del buckets["week"][bucket]
+        self.stats_journal.record(key)
+
+    def get_window(self, kind, user_id, days):
+        day_buckets = (self.stats.get(f"{kind}:{user_id}") or {}).get("day", {})
+        totals = empty_totals()
+        for day in window_days(days):
+            if day in day_buckets:
+                totals["total_amount"] += day_buckets[day][0]
+                totals["deals"] += day_buckets[day][1]
+        return totals
+
+    def adjust_total(self, user_id, delta):
+        return self._add("client", user_id, delta, 0)
+
+    def _add(self, kind, user_id, amount, deals):
+        if kind == "client":
+            table, journal = self.exchanges, self.exchanges_journal
+        else:
+            table, journal = self.exchangers, self.exchangers_journal
+        totals = table.add(user_id, amount, deals)
+        journal.record(str(user_id))
+        self.ranks[kind].update(user_id, totals["total_amount"])
+        return totals
+
+    def top(self, kind, k):
+        table = self.exchanges if kind == "client" else self.exchangers
+        return [(uid, table.get(uid)) for uid, _ in self.ranks[kind].top(k)]
+
+    def rank(self, kind, user_id):
+        return self.ranks[kind].rank(user_id), len(self.ranks[kind])
+
+    def leaderboard_version(self, kind):
+        return self.ranks[kind].version
+
+    def sizes(self):
+        return {"slots": len(self.slots), "clients": len(self.exchanges), "exchangers": len(self.exchangers),
+                "stats": len(self.stats)}
+
+    def rate_history(self):
+        return [self.rates_journal.data[v] for v in sorted(self.rates_journal.data, key=int)]
+
+    def add_rate_version(self, entry):
+        key = str(entry["version"])
+        self.rates_journal.data[key] = entry
+        self.rates_journal.record(key)
+
+    def export_rows(self, dataset):
+        # called on the event loop; the returned generator runs in a worker thread
+        if dataset == "deals":
+            return self._ledger_rows(*self._ledger_snapshot())
+        return self._total_rows(self.exchanges if dataset == "clients" else self.exchangers)
+
+    def _ledger_snapshot(self):
+        # the file up to ledger_size plus the lines not yet written cover every deal exactly once,
+        # even if the writer appends while the file is being read
+        return self.ledger_size, self.ledger_writing + self.ledger_lines
+
+    def _ledger_rows(self, size, unwritten):
+        if size:
+            with open(self.ledger_path, "rb") as f:
+                for line in f:
+                    size -= len(line)
+                    if size < 0:
+                        break
+                    yield from ledger_entries([line])
+        yield from ledger_entries(unwritten)
+
+    def _total_rows(self, table):
+        # the tables are only appended to, so reading by row index is safe
+        for row in range(len(table.ids)):
+            yield {"user_id": table.ids[row], "total_amount": table.amounts[row], "deals": table.deals[row]}
+
+    def deal_ids(self, candidates):
+        # runs in a worker thread: flush() sets ledger_size before clearing ledger_writing, so reading
+        # the lines first can at worst see a deal twice, which a set doesn't mind, but never miss one.
+        # Only the uploaded ids are kept, so memory follows the upload rather than the whole history.
+        unwritten = self.ledger_writing + self.ledger_lines
+        return {entry["id"] for entry in self._ledger_rows(self.ledger_size, unwritten) if entry["id"] in candidates}
+
+    def import_rows(self, dataset, rows):
+        # totals are replaced, not added to; deals only extend the history, they don't touch totals
+        if dataset == "deals":
+            self.ledger_lines.extend(json.dumps(row, separators=(",", ":")) + "\n" for row in rows)
+            return len(rows)
+        kind = "client" if dataset == "clients" else "exchanger"
+        current = self.get_client if kind == "client" else self.get_exchanger
+        for row in rows:
+            totals = current(row["user_id"])
+            self._add(kind, row["user_id"], row["total_amount"] - totals["total_amount"], row["deals"] - totals["deals"])
+        return len(rows)
+
+    def _append_ledger(self, lines):
+        with open(self.ledger_path, "a") as f:
+            f.write(lines)
+            return f.tell()
+
+    async def flush(self):
+        mutations = 0
+        if self.ledger_lines:
+            self.ledger_writing, self.ledger_lines = self.ledger_lines, []
+            try:
+                self.ledger_size = await asyncio.to_thread(self._append_ledger, "".join(self.ledger_writing))
+            finally:
+                self.ledger_writing = []
+        for journal in self.journals:
+            lines, count = journal.drain()
+            if lines:
+                await asyncio.to_thread(journal.write, lines)
+            mutations += count
+            if journal.records >= JOURNAL_COMPACT_EVERY:
+                journal.compact()
+        return mutations
+
+    def close(self):
+        if self.ledger_lines:
+            lines, self.ledger_lines = "".join(self.ledger_lines), []
+            self.ledger_size = self._append_ledger(lines)
+        return sum(journal.flush() for journal in self.journals)
+
+class SqliteStorage(Storage):
+    # Rows live on disk and are fetched per query, so memory stays flat as the
+    # user base grows. Each write is its own short WAL transaction.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS slots (
+            user_id INTEGER NOT NULL,
+            slot_type TEXT NOT NULL,
+            slot_num INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, slot_type, slot_num)
+        );
+        CREATE TABLE IF NOT EXISTS clients (
+            user_id INTEGER PRIMARY KEY,
+            total_amount REAL NOT NULL DEFAULT 0,
+            deals INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS clients_by_amount ON clients (total_amount);
+        CREATE TABLE IF NOT EXISTS exchangers (
+            user_id INTEGER PRIMARY KEY,
+            total_amount REAL NOT NULL DEFAULT 0,
+            deals INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS exchangers_by_amount ON exchangers (total_amount);
+        CREATE TABLE IF NOT EXISTS deals (
+            id TEXT PRIMARY KEY,
+            client_id INTEGER NOT NULL,
+            exchanger_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            ex_type TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS deals_by_client ON deals (client_id, created_at);
+        CREATE INDEX IF NOT EXISTS deals_by_exchanger ON deals (exchanger_id, created_at);
+        CREATE TABLE IF NOT EXISTS buckets (
+            kind TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            total_amount REAL NOT NULL DEFAULT 0,
+            deals INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, user_id, period, bucket)
+        );
+        CREATE TABLE IF NOT EXISTS rate_versions (
+            version INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS pending_deals (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    TABLES = {"client": "clients", "exchanger": "exchangers"}
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.db = self.connect()
+        self.db.executescript(self.SCHEMA)
+        # read-through cache for slot lookups; set_slot/delete_slot drop the user's entry
+        self.slot_cache = OrderedDict()
+        self.data_version = None
+        self.generations = 0
+        self.versions = {"client": 0, "exchanger": 0}
+        self.rank_cache = {}  # kind -> (leaderboard version, row count, {user id: rank})
+        self.worker = None  # second connection, for work done in worker threads
+        self.worker_lock = Lock()
+
+    def connect(self, timeout=SQLITE_BUSY_TIMEOUT):
+        # may be opened by the warm-up thread and then used on the event loop, never both at once;
+        # writes run on the loop, so a locked database fails fast and the user is asked to retry
+        db = sqlite3.connect(self.path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def generation(self):
+        # data_version only moves when a *different* connection commits, i.e. another worker
+        version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self.data_version:
+            if self.data_version is not None:
+                self.slot_cache.clear()
+                self.generations += 1
+            self.data_version = version
+        return self.generations
+
+    def get_slots(self, user_id):
+        uid = int(user_id)
+        self.generation()
+        slots = self.slot_cache.get(uid)
+        if slots is not None:
+            self.slot_cache.move_to_end(uid)
+            return slots
+        slots = empty_slots()
+        rows = self.db.execute("SELECT slot_type, slot_num, data FROM slots WHERE user_id = ?", (uid,))
+        for slot_type, slot_num, data in rows:
+            slots[slot_type][str(slot_num)] = json.loads(data)
+        self.slot_cache[uid] = slots
+        if len(self.slot_cache) > SLOT_CACHE_SIZE:
+            self.slot_cache.popitem(last=False)
+        return slots
+
+    def set_slot(self, user_id, slot_type, slot_num, record):
+        self.db.execute(
+            "INSERT OR REPLACE INTO slots (user_id, slot_type, slot_num, data) VALUES (?, ?, ?, ?)",
+            (int(user_id), slot_type, int(slot_num), json.dumps(record)),
+        )
+        self.slot_cache.pop(int(user_id), None)
+
+    def delete_slot(self, user_id, slot_type, slot_num):
+        self.db.execute(
+            "DELETE FROM slots WHERE user_id = ? AND slot_type = ? AND slot_num = ?",
+            (int(user_id), slot_type, int(slot_num)),
+        )
+        self.slot_cache.pop(int(user_id), None)
+
+    def get_client(self, user_id):
+        return self._totals("clients", user_id)
+
+    def get_exchanger(self, user_id):
+        return self._totals("exchangers", user_id)
+
+    def _totals(self, table, user_id):
+        row = self.db.execute(f"SELECT total_amount, deals FROM {table} WHERE user_id = ?", (int(user_id),)).fetchone()
+        if row is None:
+            return empty_totals()
+        return {"total_amount": row[0], "deals": row[1]}
+
+    def _add(self, table, user_id, amount, deals):
+        # increment in SQL rather than read-modify-write, so concurrent writers can't lose updates
+        self.db.execute(
+            f"INSERT INTO {table} (user_id, total_amount, deals) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET total_amount = total_amount + excluded.total_amount, deals = deals + excluded.deals",
+            (int(user_id), float(amount), deals),
+        )
+
+    def record_deal(self, client_id, exchanger_id, amount, ex_type="", deal_id=None, when=None):
+        with self.transaction():
+            return self._record_deal(client_id, exchanger_id, amount, ex_type, deal_id, when)
+
+    def _record_deal(self, client_id, exchanger_id, amount, ex_type, deal_id, when):
+        # deals.id is the primary key, so the same deal id can never be counted twice
+        when = when or datetime.now(tz=IST)
+        entry = deal_entry(deal_id or uuid.uuid4().hex, client_id, exchanger_id, amount, ex_type, when)
+        self.db.execute(
+            "INSERT INTO deals (id, client_id, exchanger_id, amount, ex_type, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (entry["id"], entry["client"], entry["exchanger"], entry["amount"], entry["type"], entry["at"]),
+        )
+        keys = bucket_keys(when)
+        for kind, user_id in (("client", client_id), ("exchanger", exchanger_id)):
+            self.db.executemany(
+                "INSERT INTO buckets (kind, user_id, period, bucket, total_amount, deals) VALUES (?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT (kind, user_id, period, bucket) DO UPDATE SET "
+                "total_amount = total_amount + excluded.total_amount, deals = deals + 1",
+                ((kind, int(user_id), period, bucket, float(amount)) for period, bucket in keys.items()),
+            )
+        self._add("clients", client_id, amount, 1)
+        self._add("exchangers", exchanger_id, amount, 1)
+        self.versions["client"] += 1
+        self.versions["exchanger"] += 1
+        return self._totals("clients", client_id)
+
+    def add_pending(self, deal_id, entry):
+        self.db.execute("INSERT OR REPLACE INTO pending_deals (id, data) VALUES (?, ?)", (deal_id, json.dumps(entry)))
+
+    def pending_deals(self):
+        return [(deal_id, json.loads(data)) for deal_id, data in self.db.execute("SELECT id, data FROM pending_deals")]
+
+    def claim_pending(self, deal_id):
+        # DELETE ... RETURNING is atomic, so only one worker can win a given deal;
+        # fetchall steps the statement to completion so the delete commits right away
+        rows = self.db.execute("DELETE FROM pending_deals WHERE id = ? RETURNING data", (deal_id,)).fetchall()
+        return json.loads(rows[0][0]) if rows else None
+
+    def confirm_pending(self, deal_id):
+        # claim and record commit together: a crash can't lose the deal or leave it claimable again
+        with self.transaction():
+            entry = self.claim_pending(deal_id)
+            if entry is None:
+                return None
+            return entry, self._record_deal(entry["client"], entry["exchanger"], entry["amount"], entry["type"], deal_id, None)
+
+    def get_window(self, kind, user_id, days):
+        row = self.db.execute(
+            "SELECT COALESCE(SUM(total_amount), 0), COALESCE(SUM(deals), 0) FROM buckets "
+            "WHERE kind = ? AND user_id = ? AND period = 'day' AND bucket >= ?",
+            (kind, int(user_id), window_days(days)[-1]),
+        ).fetchone()
+        return {"total_amount": row[0], "deals": row[1]}
+
+    def adjust_total(self, user_id, delta):
+        with self.transaction():
+            self._add("clients", user_id, delta, 0)
+            self.versions["client"] += 1
+            return self._totals("clients", user_id)
+
+    def top(self, kind, k):
+        # walks the total_amount index backwards, so this reads k rows
+        rows = self.db.execute(
+            f"SELECT user_id, total_amount, deals FROM {self.TABLES[kind]} ORDER BY total_amount DESC, user_id LIMIT ?",
+            (k,),
+        )
+        return [(uid, {"total_amount": total, "deals": deals}) for uid, total, deals in rows]
+
+    def rank(self, kind, user_id):
+        # counting is a walk of the amount index, so the count and each rank are kept until the board changes
+        version = self.leaderboard_version(kind)
+        cached = self._cached_rank(kind, int(user_id), version)
+        if cached is not None:
+            return cached
+        return self._store_rank(kind, int(user_id), version, *self._count_rank(self.db, kind, int(user_id)))
+
+    async def find_rank(self, kind, user_id):
+        # on a cache miss the counting runs in a worker thread on its own connection
+        version = self.leaderboard_version(kind)
+        cached = self._cached_rank(kind, int(user_id), version)
+        if cached is not None:
+            return cached
+        counted = await asyncio.to_thread(self._count_rank_off_loop, kind, int(user_id))
+        return self._store_rank(kind, int(user_id), version, *counted)
+
+    def _cached_rank(self, kind, user_id, version):
+        cached_version, count, ranks = self.rank_cache.get(kind, (None, 0, {}))
+        if cached_version == version and user_id in ranks:
+            return ranks[user_id], count
+        return None
+
+    def _store_rank(self, kind, user_id, version, rank, count):
+        cached_version, _, ranks = self.rank_cache.get(kind, (None, 0, {}))
+        if cached_version != version or len(ranks) >= RANK_CACHE_SIZE:
+            ranks = {}
+        ranks[user_id] = rank
+        self.rank_cache[kind] = (version, count, ranks)
+        return rank, count
+
+    def _count_rank_off_loop(self, kind, user_id):
+        with self.worker_db() as db:
+            return self._count_rank(db, kind, user_id)
+
+    @contextmanager
+    def worker_db(self):
+        # the second connection; it never blocks the loop, so it can wait longer on another worker's lock
+        with self.worker_lock:
+            if self.worker is None:
+                self.worker = self.connect(timeout=30)
+            yield self.worker
+
+    def _count_rank(self, db, kind, user_id):
+        table = self.TABLES[kind]
+        count = db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        row = db.execute(f"SELECT total_amount FROM {table} WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None, count
+        # two range counts rather than one OR, so both can use the (total_amount) index
+        ahead = db.execute(f"SELECT COUNT(*) FROM {table} WHERE total_amount > ?", (row[0],)).fetchone()[0]
+        tied = db.execute(f"SELECT COUNT(*) FROM {table} WHERE total_amount = ? AND user_id < ?",
+                          (row[0], user_id)).fetchone()[0]
+        return ahead + tied + 1, count
+
+    def leaderboard_version(self, kind):
+        return self.generation(), self.versions[kind]
+
+    def sizes(self):
+        # full-table counts: called from a worker thread (see http_metrics), so they use the second connection
+        with self.worker_db() as db:
+            return {
+                name: db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for name, table in (("slots", "slots"), ("clients", "clients"), ("exchangers", "exchangers"), ("deals", "deals"))
+            }
+
+    def rate_history(self):
+        return [json.loads(data) for (data,) in self.db.execute("SELECT data FROM rate_versions ORDER BY version")]
+
+    def add_rate_version(self, entry):
+        self.db.execute("INSERT INTO rate_versions (version, data) VALUES (?, ?)", (entry["version"], json.dumps(entry)))
+
+    def export_rows(self, dataset):
+        # runs in a worker thread on its own connection, reading one consistent WAL snapshot
+        db = self.connect()
+        try:
+            db.execute("BEGIN")
+            if dataset == "deals":
+                cursor = db.execute("SELECT id, client_id, exchanger_id, amount, ex_type, created_at FROM deals ORDER BY created_at")
+            else:
+                cursor = db.execute(f"SELECT user_id, total_amount, deals FROM {dataset} ORDER BY user_id")
+            columns = EXPORT_COLUMNS[dataset]
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            db.close()
+
+    async def import_batch(self, dataset, rows):
+        count = await asyncio.to_thread(self.import_rows, dataset, rows)
+        if dataset != "deals":
+            self.versions["client" if dataset == "clients" else "exchanger"] += 1
+        return count
+
+    def import_rows(self, dataset, rows):
+        # runs in a worker thread, one transaction per batch on the second connection
+        with self.worker_db() as db, self.transaction(db):
+            if dataset == "deals":
+                cursor = db.executemany(
+                    "INSERT OR IGNORE INTO deals (id, client_id, exchanger_id, amount, ex_type, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((r["id"], r["client"], r["exchanger"], r["amount"], r["type"], r["at"]) for r in rows),
+                )
+                return cursor.rowcount
+            db.executemany(
+                f"INSERT OR REPLACE INTO {dataset} (user_id, total_amount, deals) VALUES (?, ?, ?)",
+                ((r["user_id"], r["total_amount"], r["deals"]) for r in rows),
+            )
+            return len(rows)
+
+    @contextmanager
+    def transaction(self, db=None):
+        db = db or self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def import_json(self, slots_path=DATA_FILE, exchanges_path=EXCHANGE_FILE, exchangers_path=EXCHANGER_FILE,
+                    stats_path=STATS_FILE, ledger_path=LEDGER_FILE, pending_path=PENDING_FILE):
+        # one-shot: copies the JSON files (including unflushed journal records) into empty tables.
+        # Runs in the warm-up thread, so it can wait out another worker's migration.
+        self.db.execute("PRAGMA busy_timeout = 30000")
+        try:
+            return self._import_json(slots_path, exchanges_path, exchangers_path, stats_path, ledger_path, pending_path)
+        finally:
+            self.db.execute(f"PRAGMA busy_timeout = {int(SQLITE_BUSY_TIMEOUT * 1000)}")
+
+    def _import_json(self, slots_path, exchanges_path, exchangers_path, stats_path, ledger_path, pending_path):
+        sources = [p for p in (slots_path, exchanges_path, exchangers_path, stats_path, RATES_FILE, pending_path) if os.path.exists(p) or os.path.exists(f"{p}.log")]
+        if os.path.exists(ledger_path):
+            sources.append(ledger_path)
+        with self.transaction():
+            # checked under the write lock, so workers starting together import exactly once
+            if self.db.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return False
+            if sources:
+                for uid, user in Journal(slots_path, readonly=True).data.items():
+                    for slot_type, slots in user.items():
+                        self.db.executemany(
+                            "INSERT OR REPLACE INTO slots (user_id, slot_type, slot_num, data) VALUES (?, ?, ?, ?)",
+                            ((int(uid), slot_type, int(num), json.dumps(rec)) for num, rec in slots.items()),
+                        )
+                for table, path in (("clients", exchanges_path), ("exchangers", exchangers_path)):
+                    self.db.executemany(
+                        f"INSERT OR REPLACE INTO {table} (user_id, total_amount, deals) VALUES (?, ?, ?)",
+                        ((int(uid), t["total_amount"], t["deals"]) for uid, t in Journal(path, readonly=True).data.items()),
+                    )
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO rate_versions (version, data) VALUES (?, ?)",
+                    ((int(v), json.dumps(entry)) for v, entry in Journal(RATES_FILE, readonly=True).data.items()),
+                )
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO buckets (kind, user_id, period, bucket, total_amount, deals) VALUES (?, ?, ?, ?, ?, ?)",
+                    ((kind, int(uid), period, bucket, totals[0], totals[1])
+                     for key, periods in Journal(stats_path, readonly=True).data.items()
+                     for kind, uid in [key.split(":", 1)]
+                     for period, buckets in periods.items()
+                     for bucket, totals in buckets.items()),
+                )
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO pending_deals (id, data) VALUES (?, ?)",
+                    ((deal_id, json.dumps(entry)) for deal_id, entry in Journal(pending_path, readonly=True).data.items()),
+                )
+                if os.path.exists(ledger_path):
+                    with open(ledger_path, "rb") as f:
+                        self.db.executemany(
+                            "INSERT OR IGNORE INTO deals (id, client_id, exchanger_id, amount, ex_type, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                            ((e["id"], e["client"], e["exchanger"], e["amount"], e["type"], e["at"]) for e in ledger_entries(f)),
+                        )
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('json_imported', ?)", (datetime.now(tz=IST).isoformat(),))
+        if sources:
+            print(f"📦 Imported {', '.join(sources)} into {self.path}")
+        return bool(sources)
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.close()
+        self.db.close()
+        return 0
+
+def open_storage():
+    if STORAGE_BACKEND == "sqlite":
+        storage = SqliteStorage()
+        storage.import_json()
+        return storage
+    if STORAGE_BACKEND != "json":
+        raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r} (expected 'json' or 'sqlite')")
+    return JsonStorage()
+
+class LazyStorage:
+    # Opens the backend on first use, so importing the module (and a cold start)
+    # doesn't wait on loading JSON files. setup_hook warms it in a worker thread.
+    def __init__(self, opener):
+        self.opener = opener
+        self.inner = None
+        self.lock = Lock()
+
+    def is_loaded(self):
+        return self.inner is not None
+
+    def load(self):
+        if self.inner is None:
+            with self.lock:
+                if self.inner is None:
+                    started = time.perf_counter()
+                    self.inner = self.opener()
+                    print(f"📂 Loaded {STORAGE_BACKEND} storage in {time.perf_counter() - started:.2f}s")
+        return self.inner
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+storage = TracedStorage(LazyStorage(open_storage))
+
+# ---------- Persistence Writer ----------
+flush_wakeup = asyncio.Event()
+flush_stop = asyncio.Event()
+flush_stats = {
+    "flushes": 0,
+    "mutations": 0,
+    "last_mutations": 0,   # mutations covered by the most recent flush
+    "max_mutations": 0,
+    "last_seconds": 0.0,
+}
+
+def record_flush(mutations, seconds):
+    flush_stats["flushes"] += 1
+    flush_stats["mutations"] += mutations
+    flush_stats["last_mutations"] = mutations
+    flush_stats["max_mutations"] = max(flush_stats["max_mutations"], mutations)
+    flush_stats["last_seconds"] = seconds
+    flush_latency.observe(seconds)
+    flush_size.observe(mutations)
+
+async def flush_storage():
+    # nothing can be buffered before the warm-up load, and touching storage would block on it
+    if not storage.is_loaded():
+        return
+    started = time.perf_counter()
+    mutations = await storage.flush()
+    if mutations:
+        record_flush(mutations, time.perf_counter() - started)
+
+def report_flushes(since):
+    flushes = flush_stats["flushes"] - since["flushes"]
+    mutations = flush_stats["mutations"] - since["mutations"]
+    if flushes:
+        print(f"💾 {flushes} flushes covered {mutations} mutations (avg {mutations / flushes:.1f}, max {flush_stats['max_mutations']})")
+    return dict(flush_stats)
+
+async def persistence_writer():
+    reported = dict(flush_stats)
+    next_report = time.monotonic() + FLUSH_REPORT_EVERY
+    while not flush_stop.is_set():
+        try:
+            await asyncio.wait_for(flush_wakeup.wait(), timeout=FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        flush_wakeup.clear()
+        try:
+            await flush_storage()
+        except Exception as e:
+            print(f"⚠️ Persistence flush failed: {e}")
+        if time.monotonic() >= next_report:
+            reported = report_flushes(reported)
+            next_report = time.monotonic() + FLUSH_REPORT_EVERY
+
+def close_storage():
+    # forced, blocking flush used on shutdown
+    if not storage.is_loaded():
+        return
+    started = time.perf_counter()
+    mutations = storage.close()
+    if mutations:
+        record_flush(mutations, time.perf_counter() - started)
+
+# ---------- Export & Import ----------
+# Both directions stream through a temp file in a worker thread, so memory stays
+# flat however large the history is and the event loop never parses or compresses.
+IMPORT_BATCH = 500  # rows per /import transaction
+IMPORT_TYPES = {
+    "user_id": int, "total_amount": float, "deals": int,
+    "id": str, "client": int, "exchanger": int, "amount": float, "type": str, "at": str,
+}
+
+def write_export(rows, columns, fmt, fileobj):
+    count = 0
+    with gzip.GzipFile(fileobj=fileobj, mode="wb") as gz, io.TextIOWrapper(gz, encoding="utf-8", newline="") as out:
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow([row[c] for c in columns])
+                count += 1
+        else:
+            for row in rows:
+                out.write(json.dumps({c: row[c] for c in columns}, separators=(",", ":")) + "\n")
+                count += 1
+    return count
+
+def import_records(fileobj):
+    # accepts what /export produces, gzipped or not, CSV or NDJSON
+    fileobj.seek(0)
+    gzipped = fileobj.read(2) == b"\x1f\x8b"
+    fileobj.seek(0)
+    if gzipped:
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    first = text.readline()
+    if first.lstrip().startswith("{"):
+        for line in itertools.chain([first], text):
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(text, fieldnames=next(csv.reader([first]), None))
+    text.detach()  # the caller owns the file
+
+def read_import(fileobj, dataset, skip_ids=None):
+    columns = EXPORT_COLUMNS[dataset]
+    batch = []
+    records = import_records(fileobj)
+    line = 0
+    while True:
+        line += 1
+        try:
+            record = next(records, None)
+        except UnicodeDecodeError as e:
+            raise ValueError(f"the file is not UTF-8 text ({e.reason})") from None
+        except (EOFError, zlib.error, gzip.BadGzipFile) as e:
+            raise ValueError(f"the gzip data is corrupt or truncated ({e or type(e).__name__})") from None
+        except (json.JSONDecodeError, csv.Error):
+            raise ValueError(f"row {line} could not be parsed") from None
+        if record is None:
+            break
+        try:
+            row = {c: IMPORT_TYPES[c](record[c]) for c in columns}
+            if dataset == "deals":
+                datetime.fromisoformat(row["at"])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f"row {line} is not a valid {dataset} row ({', '.join(columns)})") from None
+        if skip_ids is not None:
+            # also drops repeats within the file, as INSERT OR IGNORE does on SQLite
+            if row["id"] in skip_ids:
+                continue
+            skip_ids.add(row["id"])
+        batch.append(row)
+        if len(batch) >= IMPORT_BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def scan_import(fileobj, dataset):
+    # validation pass: the row count, plus the deal ids so only those are looked up in the history
+    total, ids = 0, set()
+    for batch in read_import(fileobj, dataset):
+        total += len(batch)
+        if dataset == "deals":
+            ids.update(row["id"] for row in batch)
+    return total, ids
+
+# ---------- Rate Engine ----------
+class RateTable:
+    def __init__(self, tiers):
+        self.tiers = sorted((float(low), float(rate)) for low, rate in tiers)
+        self.lows = [low for low, _ in self.tiers]
+
+    def rate_for(self, amount):
+        # the last tier starting at or below the amount; amounts under every tier use the lowest
+        i = bisect.bisect_right(self.lows, amount) - 1
+        return self.tiers[max(i, 0)][1]
+
+class RateEngine:
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __getattr__(self, name):
+        # the history is read from storage on first use rather than at import
+        if name in ("history", "version", "rates", "tables"):
+            history = self.storage.rate_history()
+            if not history:
+                history = [{"version": 0, "rates": DEFAULT_RATES, "changed_by": None, "at": datetime.now(tz=IST).isoformat()}]
+            self.history = history
+            self._load(history[-1])
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def refresh(self):
+        # with several workers another process may have changed the rates; reload if so
+        generation = self.storage.generation()
+        if self.__dict__.get("generation") != generation:
+            for name in ("history", "version", "rates", "tables"):
+                self.__dict__.pop(name, None)
+            self.generation = generation
+        return self
+
+    def _load(self, entry):
+        self.version = entry["version"]
+        self.rates = entry["rates"]
+        self.tables = {kind: RateTable(tiers) for kind, tiers in self.rates.items()}
+
+    def table(self, kind):
+        return self.tables[kind]
+
+    def set_tier(self, kind, min_amount, rate, changed_by):
+        self.refresh()
+        tiers = {low: r for low, r in self.rates[kind]}
+        if rate:
+            tiers[float(min_amount)] = float(rate)
+        elif tiers.pop(float(min_amount), None) is None:
+            raise ValueError(f"No {kind.upper()} tier starts at {pretty_num(min_amount)}.")
+        if not tiers:
+            raise ValueError(f"{kind.upper()} needs at least one tier.")
+        entry = {
+            "version": self.version + 1,
+            "rates": {**self.rates, kind: sorted([low, r] for low, r in tiers.items())},
+            "changed_by": changed_by,
+            "at": datetime.now(tz=IST).isoformat(),
+        }
+        self.storage.add_rate_version(entry)
+        self.history.append(entry)
+        self._load(entry)
+        return entry["version"]
+
+    def describe(self, kind):
+        tiers = self.tables[kind].tiers
+        lines = []
+        for i, (low, rate) in enumerate(tiers):
+            high = tiers[i + 1][0] if i + 1 < len(tiers) else None
+            span = f"{pretty_num(low)}+" if high is None else f"{pretty_num(low)} – <{pretty_num(high)}"
+            lines.append(f"`{span}` → **{rate}**")
+        return "\n".join(lines)
+
+rate_engine = RateEngine(storage)
+
+# ---------- Metrics ----------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5  # seconds between event-loop lag samples
+STATS_LOG_FILE = os.environ.get("STATS_LOG_FILE")  # unset = no periodic dump
+STATS_LOG_EVERY = float(os.environ.get("STATS_LOG_EVERY", 300))
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_values, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labels, label_values)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # label values -> [per-bucket counts..., sum, count]
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), label_values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labels + ('le',), label_values + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, label_values)} {series[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, label_values)} {series[-1]}")
+        return lines
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+command_count = Counter("gameclub_commands_total", "Slash commands handled", ("command", "status"))
+command_latency = Histogram("gameclub_command_seconds", "Slash command handler latency", ("command",))
+flush_latency = Histogram("gameclub_flush_seconds", "Persistence flush duration")
+flush_size = Histogram("gameclub_flush_mutations", "Mutations covered by one persistence flush",
+                       buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+loop_lag = Histogram("gameclub_event_loop_lag_seconds", "How late the event loop woke a sleeping task")
+admission_shed = Counter("gameclub_shed_total", "Interactions rejected by admission control", ("command", "scope"))
+loop_lag_last = 0.0
+loop_lag_samples = deque(maxlen=TRACE_SAMPLES)
 
-user_slots = load_json(DATA_FILE, {})
-exchanges = load_json(EXCHANGE_FILE, {})
+async def sample_loop_lag():
+    global loop_lag_last
+    while True:
+        expected = time.perf_counter() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag_last = max(0.0, time.perf_counter() - expected)
+        loop_lag.observe(loop_lag_last)
+        loop_lag_samples.append(loop_lag_last)
 
-# ---------- Flask Keep-Alive ----------
-app = Flask("")
+def loop_lag_summary():
+    lags = sorted(loop_lag_samples)
+    return {f"p{p}_ms": percentile(lags, p) * 1000 for p in (50, 95, 99)}
 
-@app.route("/")
-def home():
-    return "✅ Bot is alive!"
+async def dump_stats():
+    # optional: append a JSON line of the trace summary to STATS_LOG_FILE every STATS_LOG_EVERY seconds
+    while True:
+        await asyncio.sleep(STATS_LOG_EVERY)
+        line = json.dumps({
+            "at": datetime.now(tz=IST).isoformat(),
+            "commands": trace_summary(),
+            "event_loop_lag": loop_lag_summary(),
+            "flush": flush_stats,
+        }, separators=(",", ":")) + "\n"
+        try:
+            await asyncio.to_thread(append_text, STATS_LOG_FILE, line)
+        except Exception as e:
+            print(f"⚠️ Failed to write {STATS_LOG_FILE}: {e}")
+
+def append_text(path, text):
+    with open(path, "a") as f:
+        f.write(text)
+
+def render_metrics(sizes):
+    lines = []
+    for metric in (command_count, command_latency, flush_latency, flush_size, loop_lag, admission_shed):
+        lines.extend(metric.render())
+    lines += ["# HELP gameclub_store_size Rows held by the storage backend", "# TYPE gameclub_store_size gauge"]
+    for store, size in sizes.items():
+        lines.append(f'gameclub_store_size{{store="{store}"}} {size}')
+    lines += [
+        "# HELP gameclub_gateway_latency_seconds Discord gateway heartbeat latency",
+        "# TYPE gameclub_gateway_latency_seconds gauge",
+        f"gameclub_gateway_latency_seconds {bot.latency if bot.latency == bot.latency else 'NaN'}",
+        "# HELP gameclub_up Whether the gateway connection is ready",
+        "# TYPE gameclub_up gauge",
+        f"gameclub_up {int(bot.is_ready() and not bot.is_closed())}",
+    ]
+    return "\n".join(lines) + "\n"
+
+# ---------- Health & Metrics Endpoint ----------
+async def http_home(request):
+    return web.Response(text="✅ Bot is alive!")
+
+async def http_healthz(request):
+    ready = bot.is_ready() and not bot.is_closed()
+    latency = bot.latency
+    body = {
+        "status": "ok" if ready else "starting" if not bot.is_closed() else "closed",
+        "gateway_connected": ready,
+        "gateway_latency_ms": round(latency * 1000, 1) if latency == latency and latency != float("inf") else None,
+        "event_loop_lag_ms": round(loop_lag_last * 1000, 1),
+        "guilds": len(bot.guilds),
+        "worker": WORKER_INDEX,
+        "shards": bot.shard_ids if SHARDED else None,
+    }
+    return web.json_response(body, status=200 if ready else 503)
 
-def run_web():
-    port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port)
+async def http_metrics(request):
+    # store sizes can be full-table counts, so they're taken off the loop, and skipped until storage has loaded
+    sizes = await asyncio.to_thread(storage.sizes) if storage.is_loaded() else {}
+    return web.Response(body=render_metrics(sizes).encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
-Thread(target=run_web).start()
+async def start_http_server():
+    app = web.Application()
+    app.router.add_get("/", http_home)
+    app.router.add_get("/healthz", http_healthz)
+    app.router.add_get("/metrics", http_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    # each worker gets its own port: PORT, PORT + 1, ...
+    await web.TCPSite(runner, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)) + WORKER_INDEX).start()
+    return runner
 
 # ---------- Bot ----------
 intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+
+# Slash command options arrive with their member already resolved, so nothing
+# here needs discord.py to chunk and hold every member of every guild. LOW_MEMORY
+# turns that off; the few other lookups go through member_cache.
+LOW_MEMORY = os.environ.get("LOW_MEMORY") == "1"
+
+def member_options():
+    if not LOW_MEMORY:
+        return {}
+    return {"chunk_guilds_at_startup": False, "member_cache_flags": discord.MemberCacheFlags.none()}
+
+# ---------- Admission Control ----------
+# Token buckets per user and per guild, checked before a command runs, so one
+# spammer or a raid can't fill the event loop for everyone. Limits are
+# [burst, per seconds]; "*" covers commands without their own entry and null
+# means unlimited. ADMISSION_LIMITS (JSON) overrides any of it, e.g.
+# {"user": {"done": [2, 30]}, "guilds": {"<guild id>": {"guild": {"*": [20, 10]}}}}
+ADMISSION_LIMITS = {
+    "user": {"*": [5, 10.0], "i2c": [4, 10.0], "c2i": [4, 10.0], "profile": [3, 10.0], "done": [3, 30.0]},
+    "guild": {"*": [60, 10.0]},
+    "guilds": {},  # per guild id, same layout as above
+}
+for scope, limits in json.loads(os.environ.get("ADMISSION_LIMITS") or "{}").items():
+    ADMISSION_LIMITS.setdefault(scope, {}).update(limits)
+ADMISSION_MAX_BUCKETS = 50000  # least recently used buckets are dropped past this
+
+admission_buckets = OrderedDict()
+
+def admission_limit(scope, guild_id, command):
+    # the bucket is per command only when that command has its own limit
+    layers = (ADMISSION_LIMITS["guilds"].get(str(guild_id), {}).get(scope, {}), ADMISSION_LIMITS[scope])
+    for key in (command, "*"):
+        for limits in layers:
+            if key in limits:
+                return key, limits[key]
+    return "*", None
+
+def admit(user_id, guild_id, command):
+    # returns (None, 0) when admitted, else the refusing scope and seconds until a token frees up
+    taken = []
+    for scope, owner in (("user", user_id), ("guild", guild_id)):
+        if owner is None:
+            continue  # DMs have no guild
+        key, limit = admission_limit(scope, guild_id, command)
+        if limit is None:
+            continue
+        bucket_key = (scope, guild_id, owner, key)
+        bucket = admission_buckets.get(bucket_key)
+        if bucket is None:
+            bucket = admission_buckets[bucket_key] = TokenBucket(*limit)
+            if len(admission_buckets) > ADMISSION_MAX_BUCKETS:
+                admission_buckets.popitem(last=False)
+        else:
+            admission_buckets.move_to_end(bucket_key)
+        wait = bucket.take()
+        if wait:
+            for earlier in taken:
+                earlier.tokens += 1  # refused overall, so don't charge the user
+            return scope, wait
+        taken.append(bucket)
+    return None, 0.0
+
+DB_BUSY_MSG = "⏳ The database is busy right now, nothing was saved. Please try again in a moment."
+
+class GameclubTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.type is discord.InteractionType.autocomplete:
+            return True
+        name = interaction.command.qualified_name if interaction.command else "unknown"
+        scope, wait = admit(interaction.user.id, interaction.guild_id, name)
+        if scope:
+            admission_shed.inc(name, scope)
+            if scope == "user":
+                msg = f"⏳ Slow down! Try `/{name}` again in {int(wait) + 1}s."
+            else:
+                msg = f"⏳ This server is busy right now. Try again in {int(wait) + 1}s."
+            try:
+                await interaction.response.send_message(msg, ephemeral=True)
+            except discord.HTTPException:
+                pass
+            return False
+        interaction.extras["trace"] = start_trace(f"/{name}")
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        if "trace" in interaction.extras:
+            finish_trace(interaction.extras.pop("trace"), "error")
+        if isinstance(getattr(error, "original", None), sqlite3.OperationalError):
+            # another worker held the write lock past SQLITE_BUSY_TIMEOUT; the write was rolled back
+            name = interaction.command.qualified_name if interaction.command else "unknown"
+            print(f"⚠️ /{name}: {error.original}")
+            try:
+                if interaction.response.is_done():
+                    await interaction.followup.send(DB_BUSY_MSG, ephemeral=True)
+                else:
+                    await interaction.response.send_message(DB_BUSY_MSG, ephemeral=True)
+            except discord.HTTPException:
+                pass
+            return
+        await super().on_error(interaction, error)
+
+# ---------- Command Sync ----------
+# Syncing is a global API call with its own tight rate limit. It only happens
+# when the serialized tree differs from the last one we pushed for that scope.
+COMMAND_HASH_FILE = ".command_tree_hash.json"
+DEV_GUILD_ID = os.environ.get("DEV_GUILD_ID")  # set to sync to one guild instantly while developing
+FORCE_SYNC = os.environ.get("FORCE_SYNC") == "1"
+
+def command_tree_hash(guild=None):
+    payload = sorted((cmd.to_dict() for cmd in tree.get_commands(guild=guild)), key=lambda c: c["name"])
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+async def sync_commands():
+    guild = discord.Object(id=int(DEV_GUILD_ID)) if DEV_GUILD_ID else None
+    if guild:
+        tree.copy_global_to(guild=guild)
+    scope = f"guild:{guild.id}" if guild else "global"
+    hashes = load_json(COMMAND_HASH_FILE, {})
+    current = command_tree_hash(guild)
+    if hashes.get(scope) == current and not FORCE_SYNC:
+        print(f"🟢 Slash commands unchanged ({scope}), skipping sync")
+        return
+    try:
+        await tree.sync(guild=guild)
+    except Exception as e:
+        print(f"⚠️ Failed to sync: {e}")
+        return
+    hashes[scope] = current
+    save_json(COMMAND_HASH_FILE, hashes)
+    print(f"🟢 Slash commands synced ({scope})!")
+
+# ---------- Sharding ----------
+# WORKERS > 1 runs that many processes, each an AutoShardedBot owning every
+# WORKERS-th shard. They share the SQLite store, whose totals are incremented in SQL.
+WORKERS = int(os.environ.get("WORKERS", 1))
+WORKER_INDEX = int(os.environ.get("WORKER_INDEX", 0))
+SHARD_COUNT = int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else (WORKERS if WORKERS > 1 else None)
+SHARDED = SHARD_COUNT is not None
+
+def shard_options():
+    if not SHARDED:
+        return {}
+    return {
+        "shard_count": SHARD_COUNT,
+        "shard_ids": [shard for shard in range(SHARD_COUNT) if shard % WORKERS == WORKER_INDEX],
+    }
+
+def run_workers(token):
+    if STORAGE_BACKEND != "sqlite":
+        raise SystemExit("❌ WORKERS > 1 needs STORAGE_BACKEND=sqlite so the processes share one store")
+    if SHARD_COUNT < WORKERS:
+        raise SystemExit(f"❌ SHARD_COUNT ({SHARD_COUNT}) must be at least WORKERS ({WORKERS})")
+    print(f"🚀 Starting {WORKERS} workers for {SHARD_COUNT} shards")
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            env={**os.environ, "TOKEN": token, "WORKER_INDEX": str(i), "SHARD_COUNT": str(SHARD_COUNT)}
+        )
+        for i in range(WORKERS)
+    ]
+
+    def forward(signum, frame):
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    codes = [proc.wait() for proc in procs]
+    raise SystemExit(max(codes))
+
+class GameclubBot(commands.AutoShardedBot if SHARDED else commands.Bot):
+    async def setup_hook(self):
+        # load state off the loop while we connect to the gateway
+        self.warmup_task = asyncio.create_task(asyncio.to_thread(storage.load))
+        if WORKER_INDEX == 0:
+            await sync_commands()
+        self.persistence_task = asyncio.create_task(persistence_writer())
+        self.lag_task = asyncio.create_task(sample_loop_lag())
+        self.timer_task = asyncio.create_task(timer_wheel.run())
+        self.restore_task = asyncio.create_task(restore_pending(self.warmup_task))
+        if STATS_LOG_FILE:
+            self.stats_task = asyncio.create_task(dump_stats())
+        self.http_runner = await start_http_server()
+        # Heroku restarts and deploys send SIGTERM; Client.run only handles Ctrl+C
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+
+    async def close(self):
+        if self.is_closed():
+            return
+        try:
+            await super().close()
+        finally:
+            if getattr(self, "http_runner", None):
+                await self.http_runner.cleanup()
+            for task in (getattr(self, "lag_task", None), getattr(self, "stats_task", None), getattr(self, "timer_task", None)):
+                if task:
+                    task.cancel()
+            if getattr(self, "persistence_task", None):
+                # let an in-flight flush finish so records land in order
+                flush_stop.set()
+                flush_wakeup.set()
+                await self.persistence_task
+            close_storage()
+            print(f"💾 Flushed state on shutdown ({flush_stats['flushes']} flushes, {flush_stats['mutations']} mutations total)")
+
+bot = GameclubBot(command_prefix="!", intents=intents, tree_cls=GameclubTree, **shard_options(), **member_options())
 tree = bot.tree
 
+# ---------- Outbound Messages ----------
+# Discord allows roughly 5 messages per 5 seconds per channel. discord.py already
+# backs off on 429s using the rate-limit headers; pacing sends locally keeps a busy
+# channel from hitting those 429s in the first place.
+CHANNEL_SEND_BURST = int(os.environ.get("CHANNEL_SEND_BURST", 5))
+CHANNEL_SEND_PER = float(os.environ.get("CHANNEL_SEND_PER", 5.0))
+
+class TokenBucket:
+    def __init__(self, capacity, per):
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        # takes a token even if none is left and returns how long the caller must wait for it,
+        # so concurrent callers queue up in order
+        self.refill()
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self):
+        # like reserve(), but refuses instead of queueing: 0 on success, else the wait for a token
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+channel_buckets = {}
+
+async def send_to_channel(channel, content=None, **kwargs):
+    bucket = channel_buckets.get(channel.id)
+    if bucket is None:
+        bucket = channel_buckets[channel.id] = TokenBucket(CHANNEL_SEND_BURST, CHANNEL_SEND_PER)
+    delay = bucket.reserve()
+    if delay:
+        await asyncio.sleep(delay)
+    return await channel.send(content, **kwargs)
+
+# ---------- Timer Wheel ----------
+# One task expires every pending timeout. Deadlines are wall-clock, so ones
+# restored from storage after a restart line up with the ones set before it.
+TIMER_TICK = 1.0
+TIMER_SLOTS = 64
+
+class TimerWheel:
+    def __init__(self, tick=TIMER_TICK, size=TIMER_SLOTS):
+        self.tick = tick
+        self.slots = [{} for _ in range(size)]  # key -> (deadline, callback)
+        self.where = {}  # key -> slot index
+        self.running = set()
+
+    def schedule(self, key, deadline, callback):
+        self.cancel(key)
+        # overdue entries (restored after a restart) go in the current slot
+        index = int(max(deadline, time.time()) // self.tick) % len(self.slots)
+        self.slots[index][key] = (deadline, callback)
+        self.where[key] = index
+
+    def cancel(self, key):
+        index = self.where.pop(key, None)
+        if index is not None:
+            self.slots[index].pop(key, None)
+
+    def __len__(self):
+        return len(self.where)
+
+    def expire(self, now, ticks):
+        # entries further out than one turn of the wheel share a slot and stay until their deadline
+        for tick in ticks:
+            slot = self.slots[tick % len(self.slots)]
+            for key in [key for key, (deadline, _) in slot.items() if deadline <= now]:
+                _, callback = slot.pop(key)
+                del self.where[key]
+                task = asyncio.create_task(callback())
+                self.running.add(task)
+                task.add_done_callback(self.running.discard)
+
+    async def run(self):
+        # a slot is visited once the whole tick it covers has passed
+        last = int(time.time() // self.tick)
+        while True:
+            await asyncio.sleep((last + 1) * self.tick - time.time())
+            now = time.time()
+            current = int(now // self.tick)
+            # after a stall, each slot only needs visiting once
+            self.expire(now, range(max(last, current - len(self.slots)), current))
+            last = current
+
+timer_wheel = TimerWheel()
+
 # ---------- Helpers ----------
 def pretty_num(value):
     return f"{int(value):,}" if float(value).is_integer() else f"{value:,.2f}"
@@ -64,21 +1909,247 @@ def pick_color(amount):
     return discord.Color.gold()
 
 def get_user_slot(user_id):
-    uid = str(user_id)
-    if uid not in user_slots:
-        user_slots[uid] = {"crypto": {}, "upi": {}}
-    return user_slots[uid]
+    return storage.get_slots(user_id)
+
+# ---------- Member Cache ----------
+# Display name and avatar for members we need outside a command's own options
+# (the ConfirmDone thumbnail). Entries expire so renames and new avatars show up.
+MEMBER_CACHE_SIZE = int(os.environ.get("MEMBER_CACHE_SIZE", 5000))
+MEMBER_CACHE_TTL = float(os.environ.get("MEMBER_CACHE_TTL", 600))
+
+class MemberInfo:
+    __slots__ = ("id", "display_name", "avatar_url", "expires")
+
+    def __init__(self, member, expires):
+        self.id = member.id
+        self.display_name = member.display_name
+        self.avatar_url = member.avatar.url if member.avatar else None
+        self.expires = expires
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+class MemberCache:
+    def __init__(self, size=MEMBER_CACHE_SIZE, ttl=MEMBER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # (guild id, user id) -> MemberInfo
+
+    def __len__(self):
+        return len(self.entries)
+
+    def remember(self, member):
+        key = (getattr(getattr(member, "guild", None), "id", None), member.id)
+        info = self.entries[key] = MemberInfo(member, time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return info
+
+    def lookup(self, guild_id, user_id):
+        info = self.entries.get((guild_id, user_id))
+        if info is None:
+            return None
+        if info.expires < time.monotonic():
+            del self.entries[(guild_id, user_id)]
+            return None
+        self.entries.move_to_end((guild_id, user_id))
+        return info
+
+    async def get(self, guild, user_id):
+        info = self.lookup(guild.id, user_id)
+        if info is not None:
+            return info
+        member = guild.get_member(user_id)  # always None in LOW_MEMORY mode
+        if member is None:
+            try:
+                member = await guild.fetch_member(user_id)
+            except discord.HTTPException:
+                return None
+        return self.remember(member)
+
+member_cache = MemberCache()
+
+# ---------- UPI QR Codes ----------
+# QR images are rendered here from the upi:// payment URI instead of linking
+# whatever URL was pasted, so /receivingmethod never waits on an external host.
+# Rendered PNGs are kept in a byte-bounded LRU keyed by the URI. Amount-less
+# codes (one per UPI ID) are also kept on disk, under a byte cap of their own.
+QR_CACHE_DIR = os.environ.get("QR_CACHE_DIR", "qr_cache")
+QR_CACHE_BYTES = int(os.environ.get("QR_CACHE_BYTES", 8 * 2**20))
+QR_DISK_BYTES = int(os.environ.get("QR_DISK_BYTES", 64 * 2**20))
+QR_FILENAME = "upi-qr.png"
+
+def upi_uri(upi_id, amount=None):
+    # no payee name (pn): it's optional, and leaving it out means a nickname change doesn't force a re-render
+    params = [("pa", upi_id.strip())]
+    if amount:
+        params.append(("am", f"{amount:.2f}"))
+    params.append(("cu", "INR"))
+    return "upi://pay?" + "&".join(f"{key}={quote(value, safe='@')}" for key, value in params)
+
+qr_disk_lock = Lock()
+qr_disk_size = None  # bytes in QR_CACHE_DIR, counted on the first write
+
+def read_cached_qr(path):
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # pruning drops the least recently used files first
+    return png
+
+def store_qr(path, png):
+    global qr_disk_size
+    with qr_disk_lock:
+        os.makedirs(QR_CACHE_DIR, exist_ok=True)
+        if qr_disk_size is None:
+            qr_disk_size = sum(entry.stat().st_size for entry in os.scandir(QR_CACHE_DIR) if entry.name.endswith(".png"))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(png)
+        os.replace(tmp_path, path)
+        qr_disk_size += len(png)
+        if qr_disk_size > QR_DISK_BYTES:
+            qr_disk_size = prune_qr_dir()
+
+def prune_qr_dir():
+    # trim to 90% of the cap so a full directory isn't rescanned on every write
+    files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in os.scandir(QR_CACHE_DIR) if entry.name.endswith(".png"))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= QR_DISK_BYTES * 0.9:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+    return total
+
+def render_qr(uri, on_disk=True):
+    # runs in a worker thread: disk cache first, then render
+    path = os.path.join(QR_CACHE_DIR, hashlib.sha256(uri.encode()).hexdigest()[:32] + ".png") if on_disk else None
+    if path:
+        png = read_cached_qr(path)
+        if png is not None:
+            return png
+    buffer = io.BytesIO()
+    segno.make(uri, error="m").save(buffer, kind="png", scale=8, border=2)
+    png = buffer.getvalue()
+    if path:
+        try:
+            store_qr(path, png)
+        except OSError as e:
+            print(f"⚠️ Failed to cache QR code: {e}")
+    return png
+
+class QrCache:
+    def __init__(self, max_bytes=QR_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # uri -> png bytes
+
+    async def get(self, uri, on_disk=True):
+        png = self.entries.get(uri)
+        if png is not None:
+            self.entries.move_to_end(uri)
+            return png
+        png = await asyncio.to_thread(render_qr, uri, on_disk)
+        if uri not in self.entries:
+            self.entries[uri] = png
+            self.size += len(png)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+        return png
+
+qr_cache = QrCache()
+
+# ---------- Slot Index ----------
+# Autocomplete fires on every keystroke; answers come from this index of
+# {slot_type: {slot_num: label}} per user, never from storage on the hot path
+# once a user is warm.
+SLOT_INDEX_SIZE = int(os.environ.get("SLOT_INDEX_SIZE", 20000))
+SLOT_TYPE_NAMES = {"crypto": "Crypto", "upi": "UPI"}
+
+def slot_label(slot_type, record):
+    if slot_type == "crypto":
+        address = record.get("address") or ""
+        tail = f" …{address[-6:]}" if len(address) > 6 else f" {address}"
+        return f"{record.get('type') or 'Crypto'}{tail}".strip()
+    return (record.get("upi") or "UPI").split("@")[0]
+
+class SlotIndex:
+    def __init__(self, size):
+        self.size = size
+        self.users = OrderedDict()
+        self.generation = None
+
+    def get(self, user_id):
+        uid = int(user_id)
+        generation = storage.generation()
+        if generation != self.generation:
+            self.users.clear()
+            self.generation = generation
+        labels = self.users.get(uid)
+        if labels is not None:
+            self.users.move_to_end(uid)
+            return labels
+        slots = get_user_slot(uid)
+        labels = {
+            slot_type: {int(num): slot_label(slot_type, record) for num, record in slots.get(slot_type, {}).items()}
+            for slot_type in SLOT_TYPE_NAMES
+        }
+        self.users[uid] = labels
+        if len(self.users) > self.size:
+            self.users.popitem(last=False)
+        return labels
+
+    def update(self, user_id, slot_type, slot_num, record):
+        labels = self.users.get(int(user_id))
+        if labels is not None:
+            labels[slot_type][int(slot_num)] = slot_label(slot_type, record)
+
+    def remove(self, user_id, slot_type, slot_num):
+        labels = self.users.get(int(user_id))
+        if labels is not None:
+            labels[slot_type].pop(int(slot_num), None)
+
+slot_index = SlotIndex(SLOT_INDEX_SIZE)
+
+def slot_choices(user_id, slot_type, current, include_empty=False):
+    filled = slot_index.get(user_id).get(slot_type, {})
+    choices = []
+    for num in range(1, SLOT_COUNT + 1):
+        label = filled.get(num)
+        if label is None and not include_empty:
+            continue
+        name = f"Slot {num} — {label}" if label else f"Slot {num} (empty)"
+        if current and current not in str(num) and current.lower() not in name.lower():
+            continue
+        choices.append(app_commands.Choice(name=name[:100], value=num))
+    return choices
+
+async def slot_num_autocomplete(interaction: discord.Interaction, current: str):
+    # /add-addy and /add-upi: every slot, showing what would be replaced
+    slot_type = "crypto" if interaction.command and interaction.command.name == "add-addy" else "upi"
+    return slot_choices(interaction.user.id, slot_type, current, include_empty=True)
+
+# ---------- Command Metrics ----------
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    if "trace" in interaction.extras:
+        finish_trace(interaction.extras.pop("trace"), "ok")
 
 # ---------- On Ready ----------
 @bot.event
 async def on_ready():
     print(f"✅ Logged in as {bot.user} (ID: {bot.user.id})")
     await bot.change_presence(activity=discord.Game("💱 Exchange Tracker"))
-    try:
-        await tree.sync()
-        print("🟢 Slash commands synced!")
-    except Exception as e:
-        print(f"⚠️ Failed to sync: {e}")
 
 # ---------- /ping ----------
 @tree.command(name="ping", description="Check if bot is alive")
@@ -91,67 +2162,134 @@ async def ping(interaction: discord.Interaction):
     )
     await interaction.response.send_message(embed=embed)
 
-# ---------- /i2c ----------
-@tree.command(name="i2c", description="Convert INR → USD")
-@app_commands.describe(amount="Amount in INR")
-async def i2c(interaction: discord.Interaction, amount: float):
-    usd = amount / I2C_RATE
-    color = pick_color(amount)
+# ---------- /i2c & /c2i ----------
+MAX_BATCH_AMOUNTS = 25
+
+# "10,000" and "1,00,000" are one amount; otherwise commas separate amounts like spaces and ";" do
+GROUPED_AMOUNT = re.compile(r"[₹$]?\d{1,3}(?:,\d{2})*(?:,\d{3})+(?:\.\d+)?")
+
+def split_amounts(text):
+    for part in re.split(r"[;\s]+", text.strip()):
+        if GROUPED_AMOUNT.fullmatch(part):
+            yield part.replace(",", "")
+        else:
+            yield from part.split(",")
+
+def parse_amounts(text):
+    amounts = []
+    for part in split_amounts(text):
+        if not part:
+            continue
+        try:
+            amount = float(part.replace("₹", "").replace("$", ""))
+        except ValueError:
+            raise ValueError(f"`{part}` is not a number")
+        if not 0 < amount < float("inf"):
+            raise ValueError(f"`{part}` is not a positive amount")
+        amounts.append(amount)
+    if not amounts:
+        raise ValueError("no amounts given")
+    if len(amounts) > MAX_BATCH_AMOUNTS:
+        raise ValueError(f"at most {MAX_BATCH_AMOUNTS} amounts per quote")
+    return amounts
+
+def conversion_embed(kind, amounts):
+    table = rate_engine.refresh().table(kind)
+    if kind == "i2c":
+        title, src, dst = "💱 INR → USD Conversion", "₹", "$"
+        rows = [(amount, table.rate_for(amount)) for amount in amounts]
+        rows = [(amount, rate, amount / rate) for amount, rate in rows]
+    else:
+        title, src, dst = "💱 USD → INR Conversion", "$", "₹"
+        rows = [(amount, table.rate_for(amount)) for amount in amounts]
+        rows = [(amount, rate, amount * rate) for amount, rate in rows]
+    inr_total = sum(a if kind == "i2c" else c for a, _, c in rows)
     ist_now = datetime.now(tz=IST)
-    embed = discord.Embed(
-        title="💱 INR → USD Conversion",
-        color=color,
-        timestamp=ist_now
-    )
-    embed.add_field(name="💸 Amount in INR", value=f"**₹ {pretty_num(amount)}**")
-    embed.add_field(name="💵 Converted USD", value=f"**$ {pretty_num(usd)}**")
-    embed.add_field(name="⚖️ Rate Used", value=f"**{I2C_RATE} INR per $**")
-    embed.set_footer(text=f"Time (IST): {ist_now.strftime('%I:%M %p, %d %b %Y')}")
-    await interaction.response.send_message(embed=embed)
+    embed = discord.Embed(title=title, color=pick_color(inr_total), timestamp=ist_now)
+    if len(rows) == 1:
+        amount, rate, converted = rows[0]
+        if kind == "i2c":
+            embed.add_field(name="💸 Amount in INR", value=f"**₹ {pretty_num(amount)}**")
+            embed.add_field(name="💵 Converted USD", value=f"**$ {pretty_num(converted)}**")
+        else:
+            embed.add_field(name="💵 Amount in USD", value=f"**$ {pretty_num(amount)}**")
+            embed.add_field(name="💸 Converted INR", value=f"**₹ {pretty_num(converted)}**")
+        embed.add_field(name="⚖️ Rate Used", value=f"**{rate} INR per $**")
+    else:
+        embed.description = "\n".join(
+            f"{src} {pretty_num(amount)} → **{dst} {pretty_num(round(converted, 2))}** @ {rate}"
+            for amount, rate, converted in rows
+        )
+        embed.add_field(name="Σ Amount", value=f"**{src} {pretty_num(round(sum(r[0] for r in rows), 2))}**")
+        embed.add_field(name="Σ Converted", value=f"**{dst} {pretty_num(round(sum(r[2] for r in rows), 2))}**")
+    embed.set_footer(text=f"Rates v{rate_engine.version} • Time (IST): {ist_now.strftime('%I:%M %p, %d %b %Y')}")
+    return embed
+
+async def send_conversion(interaction, kind, amounts):
+    try:
+        parsed = parse_amounts(amounts)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ Invalid amounts: {e}", ephemeral=True)
+        return
+    await interaction.response.send_message(embed=conversion_embed(kind, parsed))
+
+@tree.command(name="i2c", description="Convert INR → USD")
+@app_commands.describe(amounts="Amount in INR (10,000 is fine), or several separated by spaces or ;")
+async def i2c(interaction: discord.Interaction, amounts: str):
+    await send_conversion(interaction, "i2c", amounts)
 
-# ---------- /c2i ----------
 @tree.command(name="c2i", description="Convert USD → INR")
-@app_commands.describe(amount="Amount in USD")
-async def c2i(interaction: discord.Interaction, amount: float):
-    rate = C2I_RATE_LOW if amount < C2I_THRESHOLD else C2I_RATE_HIGH
-    inr = amount * rate
-    color = pick_color(inr)
-    ist_now = datetime.now(tz=IST)
-    embed = discord.Embed(
-        title="💱 USD → INR Conversion",
-        color=color,
-        timestamp=ist_now
-    )
-    embed.add_field(name="💵 Amount in USD", value=f"**$ {pretty_num(amount)}**")
-    embed.add_field(name="💸 Converted INR", value=f"**₹ {pretty_num(inr)}**")
-    embed.add_field(name="⚖️ Rate Used", value=f"**{rate} INR per $**")
-    embed.set_footer(text=f"Time (IST): {ist_now.strftime('%I:%M %p, %d %b %Y')}")
-    await interaction.response.send_message(embed=embed)
+@app_commands.describe(amounts="Amount in USD (10,000 is fine), or several separated by spaces or ;")
+async def c2i(interaction: discord.Interaction, amounts: str):
+    await send_conversion(interaction, "c2i", amounts)
 
 # ---------- /setrate ----------
 @tree.command(name="setrate", description="Set conversion rates (Admin only)")
-@app_commands.describe(new_rate="Enter new rate")
+@app_commands.describe(
+    new_rate="Enter new rate (0 removes the tier)",
+    min_amount="Tier applies from this amount upward (default 0)"
+)
 @app_commands.choices(rate_type=[
-    app_commands.Choice(name="I2C (INR → USD)", value="i2c"),
-    app_commands.Choice(name="C2I Low (USD < 100)", value="c2i_low"),
-    app_commands.Choice(name="C2I High (USD ≥ 100)", value="c2i_high")
+    app_commands.Choice(name="I2C (INR → USD, tiers by INR)", value="i2c"),
+    app_commands.Choice(name="C2I (USD → INR, tiers by USD)", value="c2i")
 ])
-async def setrate(interaction: discord.Interaction, rate_type: app_commands.Choice[str], new_rate: float):
-    global I2C_RATE, C2I_RATE_LOW, C2I_RATE_HIGH
+async def setrate(interaction: discord.Interaction, rate_type: app_commands.Choice[str], new_rate: float, min_amount: float = 0.0):
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("🚫 Only admins can change rates.", ephemeral=True)
         return
-    if rate_type.value == "i2c":
-        I2C_RATE = new_rate
-        title = "💱 I2C Rate Updated"
-    elif rate_type.value == "c2i_low":
-        C2I_RATE_LOW = new_rate
-        title = "💸 C2I Low Rate Updated"
-    elif rate_type.value == "c2i_high":
-        C2I_RATE_HIGH = new_rate
-        title = "💰 C2I High Rate Updated"
-    embed = discord.Embed(title=title, description=f"New rate: **{new_rate}**", color=discord.Color.gold())
-    embed.set_footer(text=f"Updated by {interaction.user.display_name}")
+    if new_rate < 0 or min_amount < 0:
+        await interaction.response.send_message("❌ Rates and tier amounts can't be negative.", ephemeral=True)
+        return
+    try:
+        version = rate_engine.set_tier(rate_type.value, min_amount, new_rate, interaction.user.id)
+    except ValueError as e:
+        await interaction.response.send_message(f"❌ {e}", ephemeral=True)
+        return
+    action = "removed" if new_rate == 0 else f"set to **{new_rate}**"
+    embed = discord.Embed(
+        title=f"💱 {rate_type.value.upper()} Rate Updated",
+        description=f"Tier from **{pretty_num(min_amount)}** {action}\n\n{rate_engine.describe(rate_type.value)}",
+        color=discord.Color.gold()
+    )
+    embed.set_footer(text=f"Rates v{version} • Updated by {interaction.user.display_name}")
+    await interaction.response.send_message(embed=embed)
+
+# ---------- /rates ----------
+@tree.command(name="rates", description="Show current rate tiers and recent changes")
+async def rates(interaction: discord.Interaction):
+    embed = discord.Embed(
+        title=f"⚖️ Current Rates (v{rate_engine.refresh().version})",
+        color=discord.Color.gold(),
+        timestamp=datetime.now(tz=IST)
+    )
+    embed.add_field(name="I2C (INR per $)", value=rate_engine.describe("i2c"), inline=False)
+    embed.add_field(name="C2I (INR per $)", value=rate_engine.describe("c2i"), inline=False)
+    changes = [
+        f"v{entry['version']} • <@{entry['changed_by']}> • {entry['at'][:16].replace('T', ' ')}"
+        for entry in reversed(rate_engine.history[-5:]) if entry.get("changed_by")
+    ]
+    if changes:
+        embed.add_field(name="Recent Changes", value="\n".join(changes), inline=False)
     await interaction.response.send_message(embed=embed)
 
 # ---------- AddSlotModal ----------
@@ -165,36 +2303,26 @@ class AddSlotModal(discord.ui.Modal):
             self.add_item(TextInput(label="Type", placeholder="e.g., USDT POLY, LTC", required=True))
         else:
             self.add_item(TextInput(label="UPI ID", placeholder="Enter your UPI ID", required=True))
-            self.add_item(TextInput(label="QR Image URL (optional)", placeholder="Paste QR image URL if no attachment", required=False))
 
+    @traced("AddSlotModal.on_submit")
     async def on_submit(self, interaction: discord.Interaction):
-        uid = str(interaction.user.id)
-        if uid not in user_slots:
-            user_slots[uid] = {"crypto": {}, "upi": {}}
-        slots = user_slots[uid][self.slot_type]
-
-        qr_url = None
-        if len(self.children) > 1 and self.children[1].value:
-            qr_url = self.children[1].value
-
         if self.slot_type == "crypto":
-            slots[str(self.slot_num)] = {
+            record = {
                 "address": self.children[0].value,
                 "type": self.children[1].value
             }
             msg = f"✅ {self.slot_type.capitalize()} Slot {self.slot_num} Updated."
         else:
-            slots[str(self.slot_num)] = {
-                "upi": self.children[0].value,
-                "qr": qr_url
-            }
+            record = {"upi": self.children[0].value}
             msg = f"✅ UPI Slot {self.slot_num} Updated."
-        save_json(DATA_FILE, user_slots)
+        storage.set_slot(interaction.user.id, self.slot_type, self.slot_num, record)
+        slot_index.update(interaction.user.id, self.slot_type, self.slot_num, record)
         await interaction.response.send_message(msg, ephemeral=True)
 
 # ---------- /add-addy ----------
 @tree.command(name="add-addy", description="Add or replace crypto slot")
 @app_commands.describe(slot_num="Slot number 1-5")
+@app_commands.autocomplete(slot_num=slot_num_autocomplete)
 async def add_addy(interaction: discord.Interaction, slot_num: int):
     if slot_num < 1 or slot_num > 5:
         await interaction.response.send_message("❌ Invalid slot! Choose 1-5.", ephemeral=True)
@@ -202,8 +2330,9 @@ async def add_addy(interaction: discord.Interaction, slot_num: int):
     await interaction.response.send_modal(AddSlotModal("crypto", slot_num))
 
 # ---------- /add-upi ----------
-@tree.command(name="add-upi", description="Add or replace UPI slot (with optional QR)")
+@tree.command(name="add-upi", description="Add or replace UPI slot")
 @app_commands.describe(slot_num="Slot number 1-5")
+@app_commands.autocomplete(slot_num=slot_num_autocomplete)
 async def add_upi(interaction: discord.Interaction, slot_num: int):
     if slot_num < 1 or slot_num > 5:
         await interaction.response.send_message("❌ Invalid slot! Choose 1-5.", ephemeral=True)
@@ -222,39 +2351,39 @@ async def add_upi(interaction: discord.Interaction, slot_num: int):
     app_commands.Choice(name="UPI", value="upi")
 ])
 async def manage_slot(interaction: discord.Interaction, action: app_commands.Choice[str], slot_type: app_commands.Choice[str], slot_num: int):
-    uid = str(interaction.user.id)
-    if uid not in user_slots:
-        user_slots[uid] = {"crypto": {}, "upi": {}}
-    slots = user_slots[uid][slot_type.value]
     if slot_num < 1 or slot_num > 5:
         await interaction.response.send_message("❌ Invalid slot! Choose 1-5.", ephemeral=True)
         return
     if action.value == "delete":
-        slots.pop(str(slot_num), None)
-        save_json(DATA_FILE, user_slots)
+        storage.delete_slot(interaction.user.id, slot_type.value, slot_num)
+        slot_index.remove(interaction.user.id, slot_type.value, slot_num)
         await interaction.response.send_message(f"✅ {slot_type.value.capitalize()} Slot {slot_num} deleted.", ephemeral=True)
     else:
         await interaction.response.send_modal(AddSlotModal(slot_type.value, slot_num))
 
-# ---------- /receiving-method (FIXED CLEAN VERSION) ----------
-@tree.command(name="receivingmethod", description="Show your saved receiving method details")
-async def receivingmethod(interaction: discord.Interaction, method: str, slot: int):
-    await interaction.response.defer(thinking=True)
-
-    # Load the saved data
-    with open("database.json", "r") as f:
-        db = json.load(f)
-
-    user_id = str(interaction.user.id)
-
-    if user_id not in db or method not in db[user_id] or str(slot) not in db[user_id][method]:
-        return await interaction.followup.send("❌ No data found for this method or slot.")
+@manage_slot.autocomplete("slot_num")
+async def manage_slot_num_autocomplete(interaction: discord.Interaction, current: str):
+    slot_type = interaction.namespace.slot_type
+    if slot_type not in SLOT_TYPE_NAMES:
+        return []
+    # delete only offers filled slots; update can also fill an empty one
+    include_empty = interaction.namespace.action != "delete"
+    return slot_choices(interaction.user.id, slot_type, current, include_empty=include_empty)
 
-    saved = db[user_id][method][str(slot)]
+# ---------- /receiving-method ----------
+@tree.command(name="receivingmethod", description="Show your saved receiving method details")
+@app_commands.describe(method="crypto or upi", slot="Slot number 1-5", amount="Amount in INR to put in the UPI QR (optional)")
+async def receivingmethod(interaction: discord.Interaction, method: str, slot: int, amount: float = None):
+    # served from the same slot store /add-addy and /add-upi write to; no disk access here
+    method = method.strip().lower()
+    saved = get_user_slot(interaction.user.id).get(method, {}).get(str(slot))
+    if saved is None:
+        return await interaction.response.send_message("❌ No data found for this method or slot.")
+    if amount is not None and amount <= 0:
+        return await interaction.response.send_message("❌ Amount must be greater than 0.", ephemeral=True)
 
-    addy = saved.get("addy", "Not set")
+    addy = saved.get("address") or saved.get("upi") or "Not set"
     type_value = saved.get("type", "N/A")
-    qr_url = saved.get("qr", None)
 
     # -------------------- BUILD EMBED --------------------
     embed = discord.Embed(
@@ -265,155 +2394,207 @@ async def receivingmethod(interaction: discord.Interaction, method: str, slot: i
 
     embed.add_field(name="💳 Addy / UPI", value=f"```{addy}```", inline=False)
 
-    if method.lower() == "crypto":
+    if method == "crypto":
         embed.add_field(name="🪙 Type", value=f"```{type_value}```", inline=False)
 
-    if qr_url is not None:
-        embed.set_image(url=qr_url)
+    # UPI QR codes are generated from the UPI ID and attached, not linked
+    qr_file = None
+    if method == "upi" and saved.get("upi"):
+        if amount:
+            embed.add_field(name="💰 Amount", value=f"₹{amount:,.2f}", inline=False)
+        # a code per amount would let anyone fill the disk, so only the amount-less one is stored there
+        png = await qr_cache.get(upi_uri(saved["upi"], amount), on_disk=amount is None)
+        qr_file = discord.File(io.BytesIO(png), filename=QR_FILENAME)
+        embed.set_image(url=f"attachment://{QR_FILENAME}")
 
     embed.set_footer(text="Payment Handler Bot • Secure")
 
     # Send the embed
-    await interaction.followup.send(embed=embed)
+    if qr_file:
+        await interaction.response.send_message(embed=embed, file=qr_file)
+    else:
+        await interaction.response.send_message(embed=embed)
 
     # ---------------- FOLLOW-UP MESSAGES ----------------
     await interaction.followup.send(f"**Addy/UPI:** `{addy}`")
     await interaction.followup.send(f"**TYPE:** `{type_value}`")
-    await interaction.followup.send(f"**QR Image:** {qr_url if qr_url else 'No QR uploaded.'}")
+    if qr_file:
+        await interaction.followup.send("**QR Image:** attached above, scan with any UPI app.")
+
+
+@receivingmethod.autocomplete("method")
+async def receivingmethod_method_autocomplete(interaction: discord.Interaction, current: str):
+    filled = slot_index.get(interaction.user.id)
+    current = current.strip().lower()
+    return [
+        app_commands.Choice(name=f"{name} ({len(filled[slot_type])} saved)", value=slot_type)
+        for slot_type, name in SLOT_TYPE_NAMES.items()
+        if current in slot_type or current in name.lower()
+    ]
+
+@receivingmethod.autocomplete("slot")
+async def receivingmethod_slot_autocomplete(interaction: discord.Interaction, current: str):
+    method = (interaction.namespace.method or "").strip().lower()
+    if method in SLOT_TYPE_NAMES:
+        return slot_choices(interaction.user.id, method, current)
+    return [
+        app_commands.Choice(name=f"{name} {choice.name}"[:100], value=choice.value)
+        for slot_type, name in SLOT_TYPE_NAMES.items()
+        for choice in slot_choices(interaction.user.id, slot_type, current)
+    ]
 
 
 # ---------- /done ----------
+# The buttons carry the exchanger and deal id in their custom_id and the deal waits
+# in storage until it's confirmed, cancelled or expires, so a prompt keeps working
+# across restarts. Clicks are routed in on_interaction, not through the view store.
+CONFIRM_TIMEOUT = 30
+CONFIRM_RETRY = 5  # seconds before retrying an expiry that hit a locked database
+CONFIRM_PREFIX = "done:"
+pending_prompts = {}  # deal id -> the /done interaction, to edit its prompt when it expires
+
 class ConfirmDone(discord.ui.View):
-    def __init__(self, user: discord.Member, amount: float, ex_type: str, exchanger: discord.Member, timeout: int = 30):
-        super().__init__(timeout=timeout)
-        self.user = user            # client (Member)
-        self.amount = amount
-        self.ex_type = ex_type
-        self.exchanger = exchanger  # person who used the command (Member)
-
-    def disable_all(self):
-        for child in self.children:
-            try:
-                child.disabled = True
-            except Exception:
-                pass
+    def __init__(self, exchanger_id: int, deal_id: str, disabled: bool = False):
+        super().__init__(timeout=None)
+        for action, label, style in (("confirm", "OKAY", discord.ButtonStyle.green), ("cancel", "CANCEL", discord.ButtonStyle.red)):
+            self.add_item(discord.ui.Button(label=label, style=style, disabled=disabled,
+                                            custom_id=f"{CONFIRM_PREFIX}{action}:{exchanger_id}:{deal_id}"))
+        # a finished view is sent as-is but never kept in discord.py's view store
+        self.stop()
 
-    async def on_timeout(self):
-        # disable buttons when view times out
-        try:
-            self.disable_all()
-            # try editing the original ephemeral message to show it's timed out (best-effort)
-            if hasattr(self, "message") and self.message:
-                await self.message.edit(content="⌛ Confirmation timed out.", view=self)
-        except Exception:
-            pass
-        finally:
-            self.stop()
+def schedule_expiry(deal_id, expires):
+    timer_wheel.schedule(deal_id, expires, functools.partial(expire_deal, deal_id))
 
-    @discord.ui.button(label="OKAY", style=discord.ButtonStyle.green)
-    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # Only the exchanger may confirm
-        if interaction.user.id != self.exchanger.id:
-            return await interaction.response.send_message("❌ Only the exchanger can confirm this.", ephemeral=True)
+def owns_pending(entry):
+    # each worker expires only the prompts it sent; worker 0 also takes over those of workers that no longer exist
+    owner = entry.get("worker", 0)
+    return owner == WORKER_INDEX or (WORKER_INDEX == 0 and owner >= WORKERS)
 
-        # Prevent double processing if button gets pressed twice quickly
-        self.disable_all()
-        try:
-            await interaction.response.defer()  # acknowledge the component interaction
-
-            # Record exchange (use client's id as string)
-            uid = str(self.user.id)
-            if uid not in exchanges:
-                exchanges[uid] = {"total_amount": 0.0, "deals": 0}
-            exchanges[uid]["total_amount"] += float(self.amount)
-            exchanges[uid]["deals"] += 1
-            save_json(EXCHANGE_FILE, exchanges)
-
-            # Public embed (visible to everyone)
-            embed = discord.Embed(
-                title="✅ Exchange Recorded",
-                color=pick_color(self.amount),
-                timestamp=datetime.now(tz=IST)
-            )
-            embed.add_field(name="Client", value=self.user.mention)
-            embed.add_field(name="Amount", value=f"${self.amount:,.2f}")
-            embed.add_field(name="Type", value=self.ex_type)
-            embed.add_field(name="Total Deals (Client)", value=str(exchanges[uid]["deals"]))
-            # safe thumbnail
-            try:
-                if self.user.avatar:
-                    embed.set_thumbnail(url=self.user.avatar.url)
-            except Exception:
-                pass
-            embed.set_footer(text=f"Recorded by {self.exchanger.display_name}")
+async def restore_pending(warmup):
+    await warmup
+    pending = [(deal_id, entry) for deal_id, entry in storage.pending_deals() if owns_pending(entry)]
+    for deal_id, entry in pending:
+        schedule_expiry(deal_id, entry["expires"])
+    if pending:
+        print(f"⏳ Restored {len(pending)} pending confirmations")
 
-            # Send public embed and messages via followup (public)
-            await interaction.followup.send(embed=embed)
+@traced("ConfirmDone.on_timeout")
+async def expire_deal(deal_id):
+    try:
+        storage.claim_pending(deal_id)
+    except sqlite3.OperationalError:
+        # another worker holds the write lock; the prompt stays live until the retry
+        schedule_expiry(deal_id, time.time() + CONFIRM_RETRY)
+        return
+    prompt = pending_prompts.pop(deal_id, None)
+    if prompt is None:
+        return
+    try:
+        # the interaction token is good for 15 minutes, so no need to fetch the message first;
+        # edited even if the claim was lost, so the prompt never keeps live buttons
+        await prompt.edit_original_response(content="⌛ Confirmation timed out.",
+                                            view=ConfirmDone(prompt.user.id, deal_id, disabled=True))
+    except discord.HTTPException:
+        pass
 
-            # Public thank you
-            await interaction.channel.send(
-                f"{self.user.mention} 🙏 Thank you for choosing Gameclub exchanges! Hope you liked our service."
-            )
+@traced("ConfirmDone.confirm")
+async def confirm_deal(interaction: discord.Interaction, exchanger_id: int, deal_id: str):
+    # Only the exchanger may confirm
+    if interaction.user.id != exchanger_id:
+        return await interaction.response.send_message("❌ Only the exchanger can confirm this.", ephemeral=True)
 
-            # Vouch: use exchanger's ID (the person who ran /done)
-            await interaction.channel.send(
-                "📌 Copy Paste this vouch in this server only or get blacklisted!"
-            )
-            await interaction.channel.send("https://discord.gg/ResmDRqhyD")
-            await interaction.channel.send(
-                f"+rep {self.exchanger.id} Legit Exchange • {self.ex_type} [${self.amount:,.2f}]"
-            )
+    closed = ConfirmDone(exchanger_id, deal_id, disabled=True)
+    try:
+        # Claiming the pending deal and recording it happen together, so a double click
+        # or a retried interaction finds nothing left to confirm
+        result = storage.confirm_pending(deal_id)
+        if result is None:
+            return await interaction.response.edit_message(content="⚠️ This exchange was already confirmed, cancelled or timed out.", view=closed)
+        timer_wheel.cancel(deal_id)
+        pending_prompts.pop(deal_id, None)
+        entry, client = result
+        amount, ex_type = entry["amount"], entry["type"]
+        mention = f"<@{entry['client']}>"
 
-            # Feedback ping: mention exchanger (not client)
-            feedback_channel_mention = "<#1371445182658252900>"
-            await interaction.channel.send(
-                f"📝 Kindly give feedback for our exchanger {self.exchanger.mention} in {feedback_channel_mention}"
-            )
+        # Acknowledge by editing the exchanger's ephemeral prompt; one round trip instead of defer + edit
+        await interaction.response.edit_message(content="✅ Exchange Confirmed!", view=closed)
+        # only after the ack: this can be a REST fetch, and it's just for the thumbnail
+        member = await member_cache.get(interaction.guild, entry["client"]) if interaction.guild else None
 
-            # Edit the ephemeral confirmation message seen by exchanger: mark as confirmed and disable buttons
-            try:
-                # interaction.message references the original ephemeral message (best-effort)
-                self.disable_all()
-                if interaction.message:
-                    await interaction.message.edit(content="✅ Exchange Confirmed!", view=self)
-            except Exception:
-                # fallback: try to send an ephemeral confirmation if editing fails
-                try:
-                    await interaction.followup.send("✅ Exchange Confirmed!", ephemeral=True)
-                except Exception:
-                    pass
+        # Public embed (visible to everyone)
+        embed = discord.Embed(
+            title="✅ Exchange Recorded",
+            color=pick_color(amount),
+            timestamp=datetime.now(tz=IST)
+        )
+        embed.add_field(name="Client", value=mention)
+        embed.add_field(name="Amount", value=f"${amount:,.2f}")
+        embed.add_field(name="Type", value=ex_type)
+        embed.add_field(name="Total Deals (Client)", value=str(client["deals"]))
+        if member and member.avatar_url:
+            embed.set_thumbnail(url=member.avatar_url)
+        embed.set_footer(text=f"Recorded by {interaction.user.display_name}")
 
-        except Exception as e:
-            # If anything goes wrong, try to notify the exchanger (ephemeral) and re-enable buttons stopped
-            try:
-                await interaction.followup.send(f"❌ Error recording exchange: {e}", ephemeral=True)
-            except Exception:
-                pass
-        finally:
-            self.stop()
+        # Thank you, feedback ping (exchanger, not client) and vouch instructions ride along with the embed
+        feedback_channel_mention = "<#1371445182658252900>"
+        await interaction.followup.send(
+            content="\n".join([
+                f"{mention} 🙏 Thank you for choosing Gameclub exchanges! Hope you liked our service.",
+                f"📝 Kindly give feedback for our exchanger {interaction.user.mention} in {feedback_channel_mention}",
+                "📌 Copy Paste this vouch in this server only or get blacklisted!",
+                "https://discord.gg/ResmDRqhyD",
+            ]),
+            embed=embed
+        )
 
-    @discord.ui.button(label="CANCEL", style=discord.ButtonStyle.red)
-    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
-        # Only the exchanger may cancel
-        if interaction.user.id != self.exchanger.id:
-            return await interaction.response.send_message("❌ Only the exchanger can cancel this.", ephemeral=True)
+        # The vouch stays a message of its own so it can be copied as-is; it uses the exchanger's ID
+        await send_to_channel(
+            interaction.channel,
+            f"+rep {exchanger_id} Legit Exchange • {ex_type} [${amount:,.2f}]"
+        )
 
-        # disable buttons immediately
-        self.disable_all()
+    except Exception as e:
+        # If anything goes wrong, try to notify the exchanger (ephemeral)
+        msg = DB_BUSY_MSG if isinstance(e, sqlite3.OperationalError) else f"❌ Error recording exchange: {e}"
         try:
-            # Edit the ephemeral confirmation message to indicate cancellation (ephemeral)
             if interaction.response.is_done():
-                # if already responded, use followup
-                await interaction.followup.send("❌ Exchange cancelled.", ephemeral=True)
+                await interaction.followup.send(msg, ephemeral=True)
             else:
-                await interaction.response.edit_message(content="❌ Exchange cancelled.", view=self)
+                await interaction.response.send_message(msg, ephemeral=True)
         except Exception:
-            try:
-                await interaction.response.send_message("❌ Exchange cancelled.", ephemeral=True)
-            except Exception:
-                pass
-        finally:
-            self.stop()
+            pass
+
+@traced("ConfirmDone.cancel")
+async def cancel_deal(interaction: discord.Interaction, exchanger_id: int, deal_id: str):
+    # Only the exchanger may cancel
+    if interaction.user.id != exchanger_id:
+        return await interaction.response.send_message("❌ Only the exchanger can cancel this.", ephemeral=True)
+
+    try:
+        claimed = storage.claim_pending(deal_id)
+    except sqlite3.OperationalError:
+        return await interaction.response.send_message(DB_BUSY_MSG, ephemeral=True)
+    timer_wheel.cancel(deal_id)
+    pending_prompts.pop(deal_id, None)
+    if claimed is None:
+        content = "⚠️ This exchange was already confirmed, cancelled or timed out."
+    else:
+        content = "❌ Exchange cancelled."
+    try:
+        await interaction.response.edit_message(content=content, view=ConfirmDone(exchanger_id, deal_id, disabled=True))
+    except discord.HTTPException:
+        pass
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    if interaction.type is not discord.InteractionType.component:
+        return
+    custom_id = (interaction.data or {}).get("custom_id", "")
+    if not custom_id.startswith(CONFIRM_PREFIX):
+        return
+    action, exchanger_id, deal_id = custom_id[len(CONFIRM_PREFIX):].split(":", 2)
+    handler = confirm_deal if action == "confirm" else cancel_deal
+    await handler(interaction, int(exchanger_id), deal_id)
 
 
 @tree.command(name="done", description="Record a completed exchange")
@@ -423,53 +2604,196 @@ class ConfirmDone(discord.ui.View):
     ex_type="Exchange type (e.g., USDT → UPI)"
 )
 async def done(interaction: discord.Interaction, user: discord.Member, amount: float, ex_type: str):
-    view = ConfirmDone(user, amount, ex_type, interaction.user, timeout=30)
+    deal_id = uuid.uuid4().hex
+    expires = time.time() + CONFIRM_TIMEOUT
+    storage.add_pending(deal_id, {
+        "client": user.id,
+        "exchanger": interaction.user.id,
+        "amount": amount,
+        "type": ex_type,
+        "expires": expires,
+        "worker": WORKER_INDEX,
+    })
+    pending_prompts[deal_id] = interaction
+    member_cache.remember(user)  # so the confirm's thumbnail doesn't need a fetch
+    schedule_expiry(deal_id, expires)
 
     # send ephemeral confirmation (only visible to exchanger)
-    # store the ephemeral message object on the view so handlers can edit it later
     await interaction.response.send_message(
         "Are you sure you want to confirm this exchange?\nPress **OKAY** to finalize.",
-        view=view,
+        view=ConfirmDone(interaction.user.id, deal_id),
         ephemeral=True
     )
-    try:
-        # attempt to save the ephemeral message object for later edits
-        view.message = await interaction.original_response()
-    except Exception:
-        # not critical if we fail to fetch the ephemeral message object
-        view.message = None
 
 # ---------- /adjust-total ----------
 @tree.command(name="adjust-total", description="Adjust total exchanged amount for a user")
 @app_commands.describe(user="Mention a user", adjust_amount="Amount to add or subtract (use negative to decrease)")
 async def adjust_total(interaction: discord.Interaction, user: discord.Member, adjust_amount: float):
-    uid = str(user.id)
-    if uid not in exchanges:
-        exchanges[uid] = {"total_amount": 0.0, "deals": 0}
-    exchanges[uid]["total_amount"] += adjust_amount
-    save_json(EXCHANGE_FILE, exchanges)
-    await interaction.response.send_message(f"✅ Total adjusted. New total: ${exchanges[uid]['total_amount']:,.2f}")
+    client = storage.adjust_total(user.id, adjust_amount)
+    await interaction.response.send_message(f"✅ Total adjusted. New total: ${client['total_amount']:,.2f}")
 
 # ---------- /profile ----------
 @tree.command(name="profile", description="View a user's exchange profile")
 @app_commands.describe(user="Mention a user")
 async def profile(interaction: discord.Interaction, user: discord.Member):
-    data = exchanges.get(str(user.id), {"total_amount": 0.0, "deals": 0})
+    member = member_cache.remember(user)
+    data = storage.get_client(user.id)
     total = data["total_amount"]
     deals = data["deals"]
     avg = total / deals if deals else 0.0
     embed = discord.Embed(
-        title=f"📊 Exchange Profile: {user.display_name}",
+        title=f"📊 Exchange Profile: {member.display_name}",
         color=discord.Color.purple(),
         timestamp=datetime.now(tz=IST)
     )
-    embed.set_thumbnail(url=user.avatar.url if user.avatar else None)
+    embed.set_thumbnail(url=member.avatar_url)
     embed.add_field(name="Total Exchanged", value=f"${total:,.2f}", inline=True)
     embed.add_field(name="Total Deals", value=str(deals), inline=True)
     embed.add_field(name="Average Deal", value=f"${avg:,.2f}", inline=True)
+    for days in PROFILE_WINDOWS:
+        window = storage.get_window("client", user.id, days)
+        embed.add_field(
+            name=f"Last {days} Days",
+            value=f"${window['total_amount']:,.2f} • {window['deals']} deals",
+            inline=True
+        )
+    handled = storage.get_exchanger(user.id)
+    if handled["deals"]:
+        embed.add_field(
+            name="Handled as Exchanger",
+            value=f"${handled['total_amount']:,.2f} • {handled['deals']} deals",
+            inline=True
+        )
     embed.set_footer(text=f"Last updated: {datetime.now(tz=IST).strftime('%I:%M %p, %d %b %Y')}")
     await interaction.response.send_message(embed=embed)
 
+# ---------- /leaderboard ----------
+LEADERBOARD_SIZE = 10
+leaderboard_cache = {}  # kind -> (storage version, embed); rebuilt only after a total changes
+
+def leaderboard_embed(kind):
+    version = storage.leaderboard_version(kind)
+    cached = leaderboard_cache.get(kind)
+    if cached and cached[0] == version:
+        return cached[1]
+    title = "🏆 Top Clients" if kind == "client" else "🏆 Top Exchangers"
+    lines = [
+        f"**#{i}** <@{uid}> — ${totals['total_amount']:,.2f} • {totals['deals']} deals"
+        for i, (uid, totals) in enumerate(storage.top(kind, LEADERBOARD_SIZE), start=1)
+    ]
+    embed = discord.Embed(
+        title=title,
+        description="\n".join(lines) or "No exchanges recorded yet.",
+        color=discord.Color.gold()
+    )
+    leaderboard_cache[kind] = (version, embed)
+    return embed
+
+@tree.command(name="leaderboard", description="Top clients or exchangers by volume")
+@app_commands.describe(board="Which leaderboard to show")
+@app_commands.choices(board=[
+    app_commands.Choice(name="Clients", value="client"),
+    app_commands.Choice(name="Exchangers", value="exchanger")
+])
+async def leaderboard(interaction: discord.Interaction, board: app_commands.Choice[str]):
+    embed = leaderboard_embed(board.value).copy()
+    rank, count = await storage.find_rank(board.value, interaction.user.id)
+    embed.add_field(name="Your Rank", value=f"#{rank} of {count}" if rank else "Unranked")
+    embed.timestamp = datetime.now(tz=IST)
+    await interaction.response.send_message(embed=embed)
+
+# ---------- /stats ----------
+@tree.command(name="stats", description="Command latency breakdown (Admin only)")
+async def stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("🚫 Only admins can view stats.", ephemeral=True)
+        return
+    summary = trace_summary()
+    lines = [
+        f"`{name}` n={s['count']} • p50 {s['p50_ms']:.0f} / p95 {s['p95_ms']:.0f} / p99 {s['p99_ms']:.0f} ms\n"
+        f"└ avg: discord {s['discord_ms']:.0f} • storage {s['storage_ms']:.1f} • own {s['own_ms']:.1f} ms"
+        for name, s in sorted(summary.items(), key=lambda item: -item[1]["p95_ms"])
+    ]
+    embed = discord.Embed(
+        title="📈 Bot Stats",
+        description="\n".join(lines)[:4000] or "No commands handled yet.",
+        color=discord.Color.teal(),
+        timestamp=datetime.now(tz=IST)
+    )
+    lag = loop_lag_summary()
+    embed.add_field(name="Event Loop Lag", value=f"p50 {lag['p50_ms']:.1f} / p95 {lag['p95_ms']:.1f} / p99 {lag['p99_ms']:.1f} ms")
+    embed.add_field(name="Flushes", value=f"{flush_stats['flushes']} • {flush_stats['mutations']} mutations • last {flush_stats['last_seconds'] * 1000:.1f} ms")
+    shed = sum(admission_shed.values.values())
+    embed.add_field(name="Gateway", value=f"{bot.latency * 1000:.0f} ms")
+    embed.add_field(name="Shed", value=f"{shed} over-limit interactions rejected")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# ---------- /export & /import ----------
+DATASET_CHOICES = [
+    app_commands.Choice(name="Client totals", value="clients"),
+    app_commands.Choice(name="Exchanger totals", value="exchangers"),
+    app_commands.Choice(name="Deal history", value="deals"),
+]
+
+@tree.command(name="export", description="Download exchange data as a compressed file (Admin only)")
+@app_commands.describe(dataset="What to export", fmt="File format")
+@app_commands.rename(fmt="format")
+@app_commands.choices(dataset=DATASET_CHOICES, fmt=[
+    app_commands.Choice(name="CSV", value="csv"),
+    app_commands.Choice(name="NDJSON", value="ndjson")
+])
+async def export_cmd(interaction: discord.Interaction, dataset: app_commands.Choice[str], fmt: app_commands.Choice[str]):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("🚫 Only admins can export data.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    spool = tempfile.TemporaryFile()
+    try:
+        rows = storage.export_rows(dataset.value)
+        count = await asyncio.to_thread(write_export, rows, EXPORT_COLUMNS[dataset.value], fmt.value, spool)
+        size = spool.tell()
+        limit = interaction.guild.filesize_limit if interaction.guild else 10 * 2**20
+        if size > limit:
+            await interaction.followup.send(f"❌ Export is {size / 2**20:.1f} MB, over this server's {limit / 2**20:.0f} MB upload limit.", ephemeral=True)
+            return
+        spool.seek(0)
+        filename = f"{dataset.value}-{datetime.now(tz=IST):%Y%m%d-%H%M}.{fmt.value}.gz"
+        await interaction.followup.send(f"📤 Exported {count} rows of {dataset.name.lower()}.",
+                                        file=discord.File(spool, filename=filename), ephemeral=True)
+    finally:
+        spool.close()
+
+@tree.command(name="import", description="Bulk-load a file made by /export (Admin only)")
+@app_commands.describe(dataset="What the file contains", file="CSV or NDJSON, optionally gzipped")
+@app_commands.choices(dataset=DATASET_CHOICES)
+async def import_cmd(interaction: discord.Interaction, dataset: app_commands.Choice[str], file: discord.Attachment):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("🚫 Only admins can import data.", ephemeral=True)
+        return
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    spool = tempfile.TemporaryFile()
+    try:
+        await file.save(spool)
+        # validate the whole file before touching storage, so a bad row can't leave a half import
+        try:
+            total, ids = await asyncio.to_thread(scan_import, spool, dataset.value)
+        except (ValueError, OSError) as e:
+            await interaction.followup.send(f"❌ Nothing imported: {e}", ephemeral=True)
+            return
+        skip_ids = await asyncio.to_thread(storage.deal_ids, ids) if dataset.value == "deals" else None
+        batches = read_import(spool, dataset.value, skip_ids)
+        imported = 0
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            imported += await storage.import_batch(dataset.value, batch)
+    finally:
+        spool.close()
+    flush_wakeup.set()
+    skipped = f" ({total - imported} duplicates skipped)" if total != imported else ""
+    await interaction.followup.send(f"📥 Imported {imported} of {total} rows of {dataset.name.lower()}{skipped}.", ephemeral=True)
+
 # ---------- /help ----------
 @tree.command(name="help", description="List all commands")
 async def help_cmd(interaction: discord.Interaction):
@@ -481,16 +2805,21 @@ async def help_cmd(interaction: discord.Interaction):
     )
     cmds = [
         ("/ping", "Check if bot is alive"),
-        ("/i2c", "Convert INR → USD"),
-        ("/c2i", "Convert USD → INR"),
-        ("/setrate", "Set conversion rates (Admin only)"),
+        ("/i2c", "Convert INR → USD (one or many amounts)"),
+        ("/c2i", "Convert USD → INR (one or many amounts)"),
+        ("/setrate", "Set conversion rate tiers (Admin only)"),
+        ("/rates", "Show current rate tiers and recent changes"),
         ("/add-addy", "Add or replace crypto slot (1-5)"),
         ("/add-upi", "Add or replace UPI slot (1-5)"),
         ("/manage-slot", "Update or delete any slot"),
-        ("/receiving-method", "View your saved crypto/UPI"),
+        ("/receivingmethod", "View your saved crypto/UPI, with a scannable UPI QR"),
         ("/done", "Record a completed exchange"),
         ("/adjust-total", "Adjust total exchanged amount for a user"),
         ("/profile", "View a user's exchange profile"),
+        ("/leaderboard", "Top clients or exchangers by volume"),
+        ("/stats", "Command latency breakdown (Admin only)"),
+        ("/export", "Download totals or deal history (Admin only)"),
+        ("/import", "Bulk-load a file made by /export (Admin only)"),
         ("/help", "Show this help message"),
         ("/commands", "Alias for /help")
     ]
@@ -501,11 +2830,14 @@ async def help_cmd(interaction: discord.Interaction):
 # ---------- /commands ----------
 @tree.command(name="commands", description="Alias for /help")
 async def commands_cmd(interaction: discord.Interaction):
-    await help_cmd(interaction)
+    await help_cmd.callback(interaction)
 
 # ---------- Run Bot ----------
-TOKEN = os.environ.get("TOKEN")
-if TOKEN:
-    bot.run(TOKEN)
-else:
-    print("❌ TOKEN not found!")
+if __name__ == "__main__":
+    TOKEN = os.environ.get("TOKEN")
+    if not TOKEN:
+        print("❌ TOKEN not found!")
+    elif WORKERS > 1 and "WORKER_INDEX" not in os.environ:
+        run_workers(TOKEN)
+    else:
+        bot.run(TOKEN)